@@ -0,0 +1,146 @@
+import os
+import time
+import math
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable
+
+from metrics import registry
+
+# Лимит на пользователя (token bucket): тикетов в секунду (0 - без лимита) и запас на всплеск
+USER_RATE_LIMIT = float(os.getenv("USER_RATE_LIMIT", "1.0"))
+USER_RATE_BURST = float(os.getenv("USER_RATE_BURST", "10"))
+# Для скольких пользователей помнить ведра; давно молчавшие вытесняются первыми
+USER_RATE_MAX_USERS = int(os.getenv("USER_RATE_MAX_USERS", "100000"))
+# Сколько тикетов воркер обрабатывает одновременно (0 - без лимита)
+TICKETS_MAX_IN_FLIGHT = int(os.getenv("TICKETS_MAX_IN_FLIGHT", "256"))
+
+TICKETS_REJECTED = registry.counter(
+    "tickets_rejected_total", "Тикеты, не принятые контролем нагрузки: user_rate - лимит пользователя, "
+    "overloaded - воркер занят", ("reason",))
+
+
+class Rejected(Exception):
+    """Тикет не принят; status - HTTP-код, retry_after - через сколько секунд повторить."""
+
+    def __init__(self, reason: str, status: int, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class RateLimiter:
+    """Token bucket на ключ: ведро на burst токенов пополняется со скоростью rate в секунду.
+
+    Хранится только (токены, время обновления) на ключ; ведра пересчитываются
+    при обращении, фоновых задач нет. Ключей не больше max_keys (LRU).
+    """
+
+    def __init__(self, rate: float = USER_RATE_LIMIT, burst: float = USER_RATE_BURST,
+                 max_keys: int = USER_RATE_MAX_USERS):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, key: str) -> float:
+        """Списывает токен; 0 - тикет пропущен, иначе сколько секунд ждать следующего токена."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [self.burst, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return 0.0
+        return (1.0 - bucket[0]) / self.rate
+
+
+class AdmissionController:
+    """Пропуск тикетов в обработку воркером.
+
+    Пользователь, исчерпавший свое ведро, получает 429, а при
+    TICKETS_MAX_IN_FLIGHT одновременных тикетов новые получают 503 - сразу,
+    а не после ожидания в очередях. Оба ответа с Retry-After. Пакет тикетов
+    занимает в общем лимите столько мест, сколько его тикетов обрабатывается
+    одновременно (admit_batch).
+    """
+
+    def __init__(self, limiter: Optional[RateLimiter] = None, max_in_flight: int = TICKETS_MAX_IN_FLIGHT):
+        self.limiter = limiter or RateLimiter()
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"user_rate": 0, "overloaded": 0}
+
+    def _reject(self, reason: str, status: int, retry_after: float):
+        self.rejected[reason] += 1
+        TICKETS_REJECTED.inc(reason=reason)
+        raise Rejected(reason, status, retry_after)
+
+    def admit(self, user_id: str) -> Callable[[], None]:
+        """Принимает тикет или бросает Rejected.
+
+        Возвращает release, которую нужно вызвать по завершении тикета;
+        повторные вызовы ничего не делают, поэтому ее можно звать из
+        нескольких мест (например, и из генератора стрима, и после него).
+        """
+        self._check_capacity(1)
+        wait = self.limiter.acquire(user_id)
+        if wait:
+            self._reject("user_rate", 429, wait)
+        return self._enter(1)
+
+    def admit_batch(self, slots: int) -> Callable[[], None]:
+        """Принимает пакет, занимающий slots мест общего лимита, или бросает Rejected (503).
+
+        Лимит пользователя к пакету не применяется: его размер ограничивают
+        TICKETS_BATCH_MAX и BATCH_LLM_CONCURRENCY. Пакет больше всего лимита
+        занимает его целиком и проходит только на свободный воркер.
+        """
+        if self.max_in_flight:
+            slots = min(slots, self.max_in_flight)
+        self._check_capacity(slots)
+        return self._enter(slots)
+
+    def _check_capacity(self, slots: int):
+        if self.max_in_flight and self.in_flight + slots > self.max_in_flight:
+            self._reject("overloaded", 503, 1.0)
+
+    def _enter(self, slots: int) -> Callable[[], None]:
+        self.in_flight += slots
+        self.admitted += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.in_flight -= slots
+        return release
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "user_rate": self.limiter.rate,
+            "user_burst": self.limiter.burst,
+        }
@@ -1,5 +1,8 @@
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
+
+from .matcher import KeywordMatcher
+from .ml_classifier import get_default as get_ticket_model
 
 logger = logging.getLogger(__name__)
 
@@ -57,15 +60,20 @@ class HybridClassifier:
             "chrome": "network",
             "firefox": "network"
         }
+        self.greeting_words = ["привет", "здравствуй", "hello", "hi"]
+        self.matcher = KeywordMatcher(list(self.keyword_mapping) + self.greeting_words)
+        # Порядок слов в словаре сохраняем: от него зависит выбор категории при равных счетах
+        self.keyword_order = {keyword: i for i, keyword in enumerate(self.keyword_mapping)}
     
     def classify(self, message: str) -> Dict[str, Any]:
-        message_lower = message.lower()
+        # Все ключевые слова находятся за один проход автомата
+        matches = self.matcher.find(message)
         
         # Считаем совпадения по ключевым словам
         category_scores = {}
-        for keyword, category in self.keyword_mapping.items():
-            if keyword in message_lower:
-                category_scores[category] = category_scores.get(category, 0) + 1
+        for keyword in sorted(matches & self.keyword_order.keys(), key=self.keyword_order.get):
+            category = self.keyword_mapping[keyword]
+            category_scores[category] = category_scores.get(category, 0) + 1
         
         # Определяем категорию
         if category_scores:
@@ -76,7 +84,7 @@ class HybridClassifier:
             confidence = 0.1
         
         # Приветствие или простой запрос
-        if any(word in message_lower for word in ["привет", "здравствуй", "hello", "hi"]):
+        if any(word in matches for word in self.greeting_words):
             confidence = 0.9
             category = "greeting"
         
@@ -84,8 +92,27 @@ class HybridClassifier:
         if len(message.strip()) < 10:
             confidence = max(confidence, 0.8)  # Высокая уверенность для LLM
         
+        # Обученная модель, если она есть и уверена, важнее подсчета слов.
+        # Загрузка идет в фоне: до ее окончания работают ключевые слова, цикл событий не ждет
+        model = get_ticket_model(wait=False)
+        if model is not None:
+            predicted = model.classify(message)
+            if predicted["confidence"] >= 0.5 or category == "other":
+                category, confidence = predicted["category"], predicted["confidence"]
+        
         return {
             "category": category,
             "confidence": confidence,
             "keywords_found": list(category_scores.keys())
-        }
\ No newline at end of file
+        }
+
+_default_classifier = None
+
+
+def classify_ticket(message: str) -> Tuple[str, float]:
+    """Категория и уверенность для сообщения (классификатор создается один раз)."""
+    global _default_classifier
+    if _default_classifier is None:
+        _default_classifier = HybridClassifier()
+    result = _default_classifier.classify(message)
+    return result["category"], result["confidence"]
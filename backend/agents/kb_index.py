@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import math
+import logging
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+
+import yaml
+
+from .matcher import KeywordMatcher
+
+logger = logging.getLogger(__name__)
+
+KB_EXTENSIONS = (".yaml", ".yml", ".json")
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    # Грубый стемминг: обрезаем слово до 5 символов, чтобы "пароль"/"пароля" совпадали
+    return [w[:5] for w in _WORD.findall(text.lower().replace("ё", "е"))]
+
+
+def directory_signature(path: str) -> Tuple[Tuple[str, int, int], ...]:
+    """Снимок (имя, mtime, размер) файлов базы знаний - по нему видно, что что-то изменилось."""
+    entries = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith(KB_EXTENSIONS):
+            stat = os.stat(os.path.join(path, name))
+            entries.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(entries)
+
+
+def load_articles(path: str) -> List[Dict[str, Any]]:
+    """Читает статьи из YAML/JSON файлов каталога (в файле - одна статья или список)."""
+    articles = []
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(KB_EXTENSIONS):
+            continue
+        with open(os.path.join(path, name), encoding="utf-8") as f:
+            data = json.load(f) if name.endswith(".json") else yaml.safe_load(f)
+        if data is None:
+            continue
+        for article in data if isinstance(data, list) else [data]:
+            article.setdefault("id", os.path.splitext(name)[0])
+            article.setdefault("category", article["id"])
+            article.setdefault("triggers", [])
+            article.setdefault("steps", [])
+            article.setdefault("confidence", 0.8)
+            if "answer" not in article:
+                raise ValueError(f"{name}: article '{article['id']}' has no answer")
+            articles.append(article)
+    return articles
+
+
+class KnowledgeIndex:
+    """Неизменяемый снимок базы знаний: статьи, обратный индекс и автомат триггеров.
+
+    При перезагрузке строится новый объект и подменяется одной ссылкой,
+    поэтому запросы, уже начавшие работу со старым снимком, не замечают смены.
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, articles: List[Dict[str, Any]], extra_vocabulary: Iterable[str] = ()):
+        self.articles = articles
+        self.loaded_at = datetime.now().isoformat()
+        self.by_category: Dict[str, List[int]] = {}
+        self.trigger_articles: Dict[str, List[int]] = {}
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+
+        for i, article in enumerate(articles):
+            self.by_category.setdefault(article["category"], []).append(i)
+            for trigger in article["triggers"]:
+                self.trigger_articles.setdefault(trigger.lower(), []).append(i)
+
+            text = " ".join([article.get("question", ""), " ".join(article["triggers"]),
+                             " ".join(article["steps"]), article["answer"]])
+            tokens = tokenize(text)
+            self.doc_lengths.append(len(tokens))
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                self.postings.setdefault(token, []).append((i, tf))
+
+        n = len(articles)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            token: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for token, docs in self.postings.items()
+        }
+        self.matcher = KeywordMatcher(list(self.trigger_articles) + list(extra_vocabulary))
+
+    @classmethod
+    def from_directory(cls, path: str, extra_vocabulary: Iterable[str] = ()) -> "KnowledgeIndex":
+        return cls(load_articles(path), extra_vocabulary)
+
+    def bm25(self, query: str, candidates: Optional[Iterable[int]] = None) -> Dict[int, float]:
+        """BM25-оценки статей по запросу; candidates ограничивает набор статей."""
+        allowed = set(candidates) if candidates is not None else None
+        scores: Dict[int, float] = {}
+        for token in set(tokenize(query)):
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for i, tf in self.postings[token]:
+                if allowed is not None and i not in allowed:
+                    continue
+                norm = tf + self.K1 * (1 - self.B + self.B * self.doc_lengths[i] / self.avg_length)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.K1 + 1) / norm
+        return scores
+
+    def best(self, query: str, candidates: Iterable[int]) -> Optional[int]:
+        candidates = list(candidates)
+        if not candidates:
+            return None
+        scores = self.bm25(query, candidates)
+        # При равных оценках побеждает статья, загруженная раньше
+        return max(candidates, key=lambda i: (scores.get(i, 0.0), -i))
+
+    def triggered(self, matches: Iterable[str]) -> List[int]:
+        hit = set()
+        for trigger in matches:
+            hit.update(self.trigger_articles.get(trigger, ()))
+        return sorted(hit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "articles": len(self.articles),
+            "terms": len(self.postings),
+            "loaded_at": self.loaded_at,
+        }
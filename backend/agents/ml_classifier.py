@@ -0,0 +1,227 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+
+from .kb_index import load_articles
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLASSIFIER_MODEL_PATH = os.getenv("CLASSIFIER_MODEL_PATH", os.path.join(BACKEND_DIR, "data", "classifier.joblib"))
+CLASSIFIER_TRAINING_PATH = os.getenv("CLASSIFIER_TRAINING_PATH", os.path.join(BACKEND_DIR, "training", "tickets.jsonl"))
+# Массивы модели открываются через mmap: воркеры делят одни страницы файла вместо своих копий
+CLASSIFIER_MMAP = os.getenv("CLASSIFIER_MMAP", "1") == "1"
+
+
+def load_examples(path: str = CLASSIFIER_TRAINING_PATH, kb_dir: Optional[str] = None) -> Tuple[List[str], List[str]]:
+    """Размеченные тикеты из JSONL (message, category) и, если задан kb_dir, вопросы и триггеры статей."""
+    texts, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            texts.append(record["message"])
+            labels.append(record["category"])
+    if kb_dir is not None:
+        for article in load_articles(kb_dir):
+            texts.append(" ".join([article.get("question", "")] + list(article["triggers"])))
+            labels.append(article["category"])
+    return texts, labels
+
+
+def build_pipeline():
+    # Импорт sklearn заметно удлиняет старт, поэтому только при обучении/загрузке
+    from sklearn.pipeline import Pipeline, FeatureUnion
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+
+    return Pipeline([
+        ("features", FeatureUnion([
+            ("words", TfidfVectorizer(analyzer="word", ngram_range=(1, 2), sublinear_tf=True, lowercase=True)),
+            # Символьные n-граммы переживают опечатки и падежи: "поолностью", "принтера"
+            ("chars", TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 5), sublinear_tf=True, lowercase=True)),
+        ])),
+        ("model", LogisticRegression(C=20.0, max_iter=2000)),
+    ])
+
+
+class TicketClassifier:
+    """Обученный классификатор тикетов: TF-IDF по словам и символьным n-граммам + логистическая регрессия.
+
+    Обучается офлайн (train_classifier.py) и сохраняется в CLASSIFIER_MODEL_PATH.
+    Уверенность - вероятность класса; temperature подбирается при обучении
+    на кросс-валидации, чтобы вероятность соответствовала доле верных ответов.
+    Веса для предсказания сохраняются готовыми (уже поделенными на
+    temperature), поэтому загрузка с mmap не копирует их в память воркера.
+    """
+
+    def __init__(self, pipeline, temperature: float = 1.0, weights=None, intercept=None):
+        import numpy as np
+
+        self.pipeline = pipeline
+        self.temperature = temperature
+        # Предсказание идет мимо sklearn: его проверки входа стоят миллисекунды на вызов.
+        # Для каждого векторайзера берем анализатор и словарь, сдвинутый на его столбцы в весах модели.
+        model = pipeline.named_steps["model"]
+        if weights is None:
+            weights = np.ascontiguousarray(model.coef_.T / temperature)
+            intercept = model.intercept_ / temperature
+        self._weights = weights
+        self._intercept = intercept
+        self._parts = []
+        idf, offsets = [], []
+        offset = 0
+        for _, vectorizer in pipeline.named_steps["features"].transformer_list:
+            self._parts.append((vectorizer.build_analyzer(),
+                                {gram: offset + j for gram, j in vectorizer.vocabulary_.items()}))
+            idf.append(vectorizer.idf_)
+            offsets.append(offset)
+            offset += len(vectorizer.vocabulary_)
+        self._idf = np.concatenate(idf)
+        # Начала столбцов векторайзеров, кроме первого: по ним столбец относится к своей части
+        self._bounds = np.array(offsets[1:], dtype=np.intp)
+
+    @property
+    def categories(self) -> List[str]:
+        return list(self.pipeline.classes_)
+
+    @classmethod
+    def train(cls, texts: List[str], labels: List[str], calibrate: bool = True) -> "TicketClassifier":
+        pipeline = build_pipeline()
+        temperature = fit_temperature(texts, labels) if calibrate else 1.0
+        pipeline.fit(texts, labels)
+        return cls(pipeline, temperature)
+
+    def save(self, path: str = CLASSIFIER_MODEL_PATH):
+        import joblib
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        # Без сжатия: только такие массивы joblib умеет открыть через mmap
+        joblib.dump({"pipeline": self.pipeline, "temperature": self.temperature,
+                     "weights": self._weights, "intercept": self._intercept}, tmp)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = CLASSIFIER_MODEL_PATH, mmap: bool = CLASSIFIER_MMAP) -> "TicketClassifier":
+        import joblib
+
+        data = joblib.load(path, mmap_mode="r" if mmap else None)
+        # Файлы, сохраненные до появления готовых весов, пересчитываются при загрузке
+        return cls(data["pipeline"], data["temperature"], data.get("weights"), data.get("intercept"))
+
+    def _logits(self, messages: List[str]):
+        """Логиты батча: одна разреженная матрица признаков и одно умножение на веса."""
+        import numpy as np
+        from scipy.sparse import csr_matrix
+
+        # В Python остается только разбор на n-граммы и поиск в словаре;
+        # повторы n-грамм складывает в счетчики сама матрица (sum_duplicates)
+        columns, indptr = [], [0]
+        for message in messages:
+            for analyzer, vocabulary in self._parts:
+                columns.extend(j for j in map(vocabulary.get, analyzer(message)) if j is not None)
+            indptr.append(len(columns))
+        features = csr_matrix((np.ones(len(columns)), np.array(columns, dtype=np.intp), indptr),
+                              shape=(len(messages), len(self._idf)))
+        features.sum_duplicates()
+        # sublinear_tf и l2-нормировка - как в TfidfVectorizer, отдельно по части каждого векторайзера
+        values = (1 + np.log(features.data)) * self._idf[features.indices]
+        rows = np.repeat(np.arange(len(messages)), np.diff(features.indptr))
+        groups = rows * len(self._parts) + np.searchsorted(self._bounds, features.indices, side="right")
+        norms = np.bincount(groups, weights=values * values, minlength=len(messages) * len(self._parts))
+        values /= np.sqrt(norms)[groups]
+        features.data = values
+        return features @ self._weights + self._intercept
+
+    def predict_proba(self, messages: List[str]):
+        import numpy as np
+
+        logits = self._logits(messages)
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def classify_batch(self, messages: List[str]) -> List[Dict[str, Any]]:
+        """Категория и уверенность для каждого сообщения."""
+        if not messages:
+            return []
+        probs = self.predict_proba(messages)
+        classes = self.pipeline.classes_
+        best = probs.argmax(axis=1)
+        return [{"category": str(classes[j]), "confidence": float(probs[i, j])} for i, j in enumerate(best)]
+
+    def classify(self, message: str) -> Dict[str, Any]:
+        return self.classify_batch([message])[0]
+
+
+def fit_temperature(texts: List[str], labels: List[str], folds: int = 5) -> float:
+    """Temperature scaling по out-of-fold логитам: минимизирует log-loss на отложенных тикетах."""
+    import numpy as np
+    from sklearn.model_selection import StratifiedKFold
+
+    classes = sorted(set(labels))
+    y = np.array([classes.index(label) for label in labels])
+    logits = np.zeros((len(texts), len(classes)))
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=0)
+    for train_idx, test_idx in splitter.split(texts, y):
+        pipeline = build_pipeline()
+        pipeline.fit([texts[i] for i in train_idx], [labels[i] for i in train_idx])
+        fold = pipeline.decision_function([texts[i] for i in test_idx])
+        columns = [classes.index(c) for c in pipeline.classes_]
+        logits[np.ix_(test_idx, columns)] = fold
+
+    def log_loss(t: float) -> float:
+        scaled = logits / t
+        scaled -= scaled.max(axis=1, keepdims=True)
+        log_probs = scaled - np.log(np.exp(scaled).sum(axis=1, keepdims=True))
+        return float(-log_probs[np.arange(len(y)), y].mean())
+
+    candidates = np.exp(np.linspace(np.log(0.05), np.log(20), 200))
+    return float(min(candidates, key=log_loss))
+
+
+_default: Optional[TicketClassifier] = None
+_default_loaded = threading.Event()
+_default_lock = threading.Lock()
+_default_loading = False
+
+
+def _load_default(path: str):
+    global _default
+    try:
+        if os.path.exists(path):
+            _default = TicketClassifier.load(path)
+            logger.info(f"Ticket classifier loaded: {len(_default.categories)} categories")
+        else:
+            logger.info(f"No trained classifier at {path}, using keywords")
+    except Exception as e:
+        logger.warning(f"Ticket classifier not loaded, using keywords: {e}")
+    finally:
+        _default_loaded.set()
+
+
+def get_default(wait: bool = True, path: str = CLASSIFIER_MODEL_PATH) -> Optional[TicketClassifier]:
+    """Модель воркера, загружается один раз; None, если модель не обучена.
+
+    С wait=False загрузка (импорт sklearn - около секунды) идет в фоновом
+    потоке, а пока она не закончилась, возвращается None.
+    """
+    global _default_loading
+    if _default_loaded.is_set():
+        return _default
+    with _default_lock:
+        # Грузим уже вне блокировки: иначе вызов с wait=False ждал бы чужую загрузку
+        first = not _default_loading
+        _default_loading = True
+    if first:
+        if wait:
+            _load_default(path)
+        else:
+            threading.Thread(target=_load_default, args=(path,), daemon=True).start()
+    if wait:
+        _default_loaded.wait()
+    return _default
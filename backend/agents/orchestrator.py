@@ -1,15 +1,165 @@
+import time
+import asyncio
+import logging
+from typing import Dict, List, Any, Optional, Callable, Tuple
+
 from .classifier import classify_ticket
 from .rag_search import search_knowledge_base
 from .action_planner import plan_actions
 from .response_generator import generate_response
 
-def process_ticket(message: str) -> str:
-    category, confidence = classify_ticket(message)
-    if confidence < 0.7:
+logger = logging.getLogger(__name__)
+
+
+class TicketContext:
+    """Состояние тикета, которое стадии читают и дополняют."""
+
+    def __init__(self, message: str, user_id: Optional[str] = None):
+        self.message = message
+        self.user_id = user_id
+        self.results: Dict[str, Any] = {}
+        self.errors: Dict[str, str] = {}
+        self.timings: Dict[str, float] = {}
+        self.answer: Optional[Any] = None
+        self.finished = False
+
+    def finish(self, answer: Any):
+        """Досрочное завершение: оставшиеся стадии не запускаются, запущенные отменяются."""
+        self.answer = answer
+        self.finished = True
+
+
+class Stage:
+    """Стадия конвейера.
+
+    requires - имена стадий, которые должны завершиться раньше (успешно или нет:
+    стадия сама решает, что делать без результата). timeout - лимит в секундах;
+    по истечении стадия считается неудавшейся, конвейер идет дальше.
+    """
+
+    name = ""
+    requires: Tuple[str, ...] = ()
+    timeout: Optional[float] = None
+
+    async def run(self, ctx: TicketContext) -> Any:
+        raise NotImplementedError
+
+
+class FunctionStage(Stage):
+    """Стадия из функции fn(ctx); синхронная функция вызывается прямо в event loop."""
+
+    def __init__(self, name: str, fn: Callable[[TicketContext], Any],
+                 requires: Tuple[str, ...] = (), timeout: Optional[float] = None):
+        self.name = name
+        self.fn = fn
+        self.requires = requires
+        self.timeout = timeout
+
+    async def run(self, ctx: TicketContext) -> Any:
+        result = self.fn(ctx)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+
+class Orchestrator:
+    """Запускает стадии по зависимостям, независимые - параллельно.
+
+    Стадия стартует, как только завершились все ее requires. Результат
+    попадает в ctx.results[name], ошибка или таймаут - в ctx.errors[name].
+    Если стадия вызвала ctx.finish(), остальные стадии не выполняются.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        names = [stage.name for stage in stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate stage names: {names}")
+        for stage in stages:
+            unknown = set(stage.requires) - set(names)
+            if unknown:
+                raise ValueError(f"Stage '{stage.name}' requires unknown stages: {sorted(unknown)}")
+        self.stages = stages
+
+    async def _run_stage(self, stage: Stage, ctx: TicketContext):
+        started = time.perf_counter()
+        try:
+            if stage.timeout is not None:
+                ctx.results[stage.name] = await asyncio.wait_for(stage.run(ctx), stage.timeout)
+            else:
+                ctx.results[stage.name] = await stage.run(ctx)
+        except asyncio.TimeoutError:
+            ctx.errors[stage.name] = f"timeout after {stage.timeout}s"
+            logger.warning(f"Stage '{stage.name}' timed out after {stage.timeout}s")
+        except Exception as e:
+            ctx.errors[stage.name] = str(e)
+            logger.error(f"Stage '{stage.name}' failed: {e}")
+        finally:
+            ctx.timings[stage.name] = time.perf_counter() - started
+
+    async def run(self, ctx: TicketContext) -> TicketContext:
+        waiting = list(self.stages)
+        done: set = set()
+        running: Dict[asyncio.Task, Stage] = {}
+
+        while waiting or running:
+            for stage in [s for s in waiting if done.issuperset(s.requires)]:
+                waiting.remove(stage)
+                running[asyncio.create_task(self._run_stage(stage, ctx))] = stage
+            if not running:
+                break
+
+            finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                done.add(running.pop(task).name)
+
+            if ctx.finished:
+                for task in running:
+                    task.cancel()
+                await asyncio.gather(*running, return_exceptions=True)
+                break
+
+        return ctx
+
+
+def _classify(ctx: TicketContext) -> Tuple[str, float]:
+    return classify_ticket(ctx.message)
+
+
+def _retrieve(ctx: TicketContext) -> List[Dict[str, Any]]:
+    category, _ = ctx.results.get("classify", ("other", 0.0))
+    results = search_knowledge_base(ctx.message, category)
+    if results and results[0].get("confidence", 0) > 0.7 and results[0]["category"] == category:
+        ctx.finish(results[0]["answer"])
+    return results
+
+
+def _plan(ctx: TicketContext) -> List[Dict[str, Any]]:
+    category, _ = ctx.results.get("classify", ("other", 0.0))
+    # Статьи чужих категорий совпали лишь по отдельным словам - в план их не берем
+    return plan_actions(category, [r for r in ctx.results.get("retrieve", []) if r["category"] == category])
+
+
+def _generate(ctx: TicketContext) -> str:
+    return generate_response(ctx.results.get("plan", []))
+
+
+default_pipeline = Orchestrator([
+    FunctionStage("classify", _classify),
+    FunctionStage("retrieve", _retrieve, requires=("classify",)),
+    FunctionStage("plan", _plan, requires=("retrieve",)),
+    FunctionStage("generate", _generate, requires=("plan",)),
+])
+
+
+async def process_ticket_async(message: str, pipeline: Orchestrator = default_pipeline) -> str:
+    ctx = await pipeline.run(TicketContext(message))
+    if ctx.finished:
+        return ctx.answer
+    _, confidence = ctx.results.get("classify", ("other", 0.0))
+    if confidence < 0.7 or not ctx.results.get("plan"):
         return "Ваш запрос будет передан оператору."
-    
-    knowledge_results = search_knowledge_base(message)
-    actions = plan_actions(category, knowledge_results)
-    
-    response = generate_response(actions)
-    return response
+    return ctx.results.get("generate") or generate_response([])
+
+
+def process_ticket(message: str) -> str:
+    return asyncio.run(process_ticket_async(message))
@@ -1,113 +1,222 @@
+import os
+import glob
+import json
+import hashlib
 import logging
-from typing import Dict, List, Any, Optional
+import threading
+from typing import Dict, List, Any, Optional, Callable, Tuple
+
+import numpy as np
+
+from .kb_index import KnowledgeIndex
 
 logger = logging.getLogger(__name__)
 
+KB_DIR = os.getenv("KB_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "knowledge"))
+
 class KnowledgeBase:
-    def __init__(self):
-        self.solutions = {
-            "password_reset": [
-                {
-                    "question": "сброс пароля",
-                    "answer": """Для сброса пароля в корпоративной системе:
-
-1. Перейдите на portal.rosatom.ru/password-reset
-2. Введите ваш корпоративный email
-3. Подтвердите личность через СМС-код
-4. Установите новый пароль
-
-Требования к паролю:
-- Не менее 12 символов
-- Заглавные и строчные буквы
-- Цифры и специальные символы
-- Не должен содержать личную информацию
-
-Если не получается - позвоните в поддержку: 8-800-xxx-xx-xx""",
-                    "steps": [
-                        "Перейти на портал восстановления пароля",
-                        "Ввести корпоративный email",
-                        "Подтвердить через СМС",
-                        "Установить новый пароль"
-                    ],
-                    "confidence": 0.9
-                }
-            ],
-            
-            "access_issues": [
-                {
-                    "question": "нет доступа к системе",
-                    "answer": """Решение проблем с доступом:
-
-1. Проверьте подключение к корпоративной сети
-2. Убедитесь, что учетная запись активна
-3. Обратитесь к руководителю для подтверждения прав доступа
-4. Очистите кэш браузера или перезапустите приложение
-
-Для доступа к SAP/1C требуется дополнительная авторизация.
-Срок предоставления доступа - до 2 рабочих часов.""",
-                    "steps": [
-                        "Проверить сетевое подключение",
-                        "Проверить активность учетной записи", 
-                        "Получить подтверждение прав",
-                        "Очистить кэш браузера"
-                    ],
-                    "confidence": 0.8
-                }
-            ],
-            
-            "hardware": [
-                {
-                    "question": "проблемы с принтером",
-                    "answer": """Устранение проблем с печатью:
-
-1. Проверьте подключение принтера к сети и компьютеру
-2. Убедитесь, что принтер выбран по умолчанию
-3. Очистите очередь печати (Панель управления → Устройства → Очередь печати)
-4. Переустановите драйверы принтера
-
-Для запроса нового оборудования заполните форму на портале закупок.""",
-                    "steps": [
-                        "Проверить подключение принтера",
-                        "Выбрать принтер по умолчанию",
-                        "Очистить очередь печати",
-                        "Переустановить драйверы"
-                    ],
-                    "confidence": 0.7
-                }
-            ],
-            
-            "greeting": [
-                {
-                    "question": "приветствие",
-                    "answer": """Добро пожаловать в систему техподдержки Росатом! 🤖
-
-Я помогу вам с:
-• Сбросом паролей
-• Проблемами доступа к системам
-• Вопросами по оборудованию
-• Настройкой ПО
-• Сетевыми проблемами
-
-Опишите вашу проблему подробно, и я постараюсь помочь!""",
-                    "steps": [],
-                    "confidence": 0.95
-                }
-            ]
-        }
+    def __init__(self, path: str = KB_DIR):
+        # Статьи общие с main.py и лежат в каталоге knowledge/
+        self.index = KnowledgeIndex.from_directory(path)
     
     def search(self, query: str, category: str) -> Optional[Dict[str, Any]]:
-        query_lower = query.lower()
+        index = self.index
         
         # Ищем в конкретной категории
-        if category in self.solutions:
-            for solution in self.solutions[category]:
-                if any(keyword in query_lower for keyword in solution["question"].split()):
-                    return solution
+        in_category = index.by_category.get(category, [])
+        scores = index.bm25(query, in_category)
+        if scores:
+            return index.articles[max(scores, key=scores.get)]
         
         # Ищем во всех категориях
-        for cat_solutions in self.solutions.values():
-            for solution in cat_solutions:
-                if any(keyword in query_lower for keyword in solution["question"].split()):
-                    return solution
+        scores = index.bm25(query)
+        if scores:
+            return index.articles[max(scores, key=scores.get)]
         
-        return None
\ No newline at end of file
+        return None
+
+    def search_all(self, query: str, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Все статьи с ненулевым BM25: сначала своей категории, затем остальные."""
+        index = self.index
+        in_category = index.by_category.get(category, []) if category else []
+        ranked = []
+        for candidates in (in_category, None):
+            scores = index.bm25(query, candidates)
+            ranked.extend(i for i in sorted(scores, key=scores.get, reverse=True) if i not in ranked)
+        return [index.articles[i] for i in ranked]
+
+
+_default_kb: Optional[KnowledgeBase] = None
+
+
+def search_knowledge_base(query: str, category: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Поиск по базе знаний из KB_DIR (индекс строится при первом вызове)."""
+    global _default_kb
+    if _default_kb is None:
+        _default_kb = KnowledgeBase()
+    return _default_kb.search_all(query, category)
+
+
+RAG_MODEL = os.getenv("RAG_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "rag_index"))
+
+
+def split_passages(article: Dict[str, Any]) -> List[str]:
+    """Делит статью на абзацы; к каждому добавляется вопрос статьи для контекста."""
+    title = article.get("question", article["id"])
+    paragraphs = [p.strip() for p in article["answer"].split("\n\n") if p.strip()]
+    return [f"{title}. {p}" for p in paragraphs] or [title]
+
+
+class EmbeddingRetriever:
+    """Поиск по эмбеддингам статей базы знаний.
+
+    Абзацы статей кодируются один раз и сохраняются в RAG_INDEX_DIR:
+    passages.json со списком абзацев и ссылкой на файл матрицы
+    vectors-<хеш порядка абзацев>.npy. Файл матрицы после записи не меняется,
+    поэтому его строки всегда соответствуют абзацам, которые на него
+    ссылаются. Если сохраненный порядок абзацев совпадает с текущим, матрица
+    открывается через mmap; иначе она собирается в памяти в порядке
+    текущих абзацев (кодируются только новые) и сохраняется заново.
+    Запрос - одно умножение матрицы запросов на матрицу абзацев (косинус,
+    вектора нормированы). Работает только на CPU.
+    """
+
+    def __init__(self, model_name: str = RAG_MODEL, index_dir: str = RAG_INDEX_DIR,
+                 encoder: Optional[Callable[[List[str]], np.ndarray]] = None):
+        self.model_name = model_name
+        self.index_dir = index_dir
+        self._encoder = encoder
+        self._lock = threading.Lock()
+        # Абзацы, статьи и матрица подменяются одной ссылкой: search_batch из другого потока
+        # не увидит абзацы от нового индекса с матрицей от старого
+        self._state: Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]], Optional[np.ndarray]] = ([], {}, None)
+
+    @property
+    def passages(self) -> List[Dict[str, Any]]:
+        return self._state[0]
+
+    @property
+    def articles(self) -> Dict[str, Dict[str, Any]]:
+        return self._state[1]
+
+    @property
+    def vectors(self) -> Optional[np.ndarray]:
+        return self._state[2]
+
+    @property
+    def ready(self) -> bool:
+        return self.vectors is not None
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if self._encoder is None:
+            # Импорт тяжелый (torch), поэтому только при первом использовании
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(self.model_name, device="cpu")
+            self._encoder = lambda batch: model.encode(
+                batch, batch_size=32, normalize_embeddings=True, convert_to_numpy=True
+            )
+        return np.asarray(self._encoder(texts), dtype=np.float32)
+
+    @staticmethod
+    def _passage_hash(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _order_hash(hashes: List[str]) -> str:
+        return hashlib.sha1("\n".join(hashes).encode("utf-8")).hexdigest()[:16]
+
+    def _load_saved(self) -> Tuple[List[str], Optional[np.ndarray]]:
+        """Хеши сохраненных абзацев по порядку и их матрица (mmap); ([], None), если индекса нет."""
+        passages_path = os.path.join(self.index_dir, "passages.json")
+        if not os.path.exists(passages_path):
+            return [], None
+        with open(passages_path, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("model") != self.model_name or "vectors" not in saved:
+            return [], None
+        hashes = [p["hash"] for p in saved["passages"]]
+        try:
+            vectors = np.load(os.path.join(self.index_dir, saved["vectors"]), mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.warning(f"RAG index {saved['vectors']} unreadable: {e}")
+            return [], None
+        if len(vectors) != len(hashes) or saved["vectors"] != f"vectors-{self._order_hash(hashes)}.npy":
+            return [], None
+        return hashes, vectors
+
+    def _save(self, passages: List[Dict[str, Any]], vectors: np.ndarray):
+        os.makedirs(self.index_dir, exist_ok=True)
+        name = f"vectors-{self._order_hash([p['hash'] for p in passages])}.npy"
+        # Пишем во временные файлы и переименовываем, чтобы второй воркер не прочитал половину
+        tmp_vectors = os.path.join(self.index_dir, f"vectors.{os.getpid()}.tmp.npy")
+        tmp_passages = os.path.join(self.index_dir, f"passages.{os.getpid()}.tmp")
+        np.save(tmp_vectors, vectors)
+        with open(tmp_passages, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "vectors": name, "passages": passages}, f, ensure_ascii=False)
+        # Сначала матрица, потом ссылка на нее: passages.json никогда не указывает на недописанный файл
+        os.replace(tmp_vectors, os.path.join(self.index_dir, name))
+        os.replace(tmp_passages, os.path.join(self.index_dir, "passages.json"))
+        for path in glob.glob(os.path.join(self.index_dir, "vectors*.npy")):
+            # Открытые через mmap у других воркеров файлы после удаления остаются доступны им
+            if os.path.basename(path) != name and ".tmp." not in path:
+                os.remove(path)
+
+    def sync(self, articles: List[Dict[str, Any]]):
+        """Приводит индекс в соответствие со статьями; кодирует только новые абзацы."""
+        with self._lock:
+            passages = [
+                {"article_id": a["id"], "category": a["category"], "text": text, "hash": self._passage_hash(text)}
+                for a in articles for text in split_passages(a)
+            ]
+            hashes, saved_vectors = self._load_saved()
+            if passages and hashes == [p["hash"] for p in passages]:
+                # Сохраненная матрица построена ровно для этих абзацев в этом порядке
+                vectors = saved_vectors
+            else:
+                saved = dict(zip(hashes, saved_vectors)) if saved_vectors is not None else {}
+                missing = [p for p in passages if p["hash"] not in saved]
+                encoded = dict(zip((p["hash"] for p in missing),
+                                   self._encode([p["text"] for p in missing]))) if missing else {}
+                if passages:
+                    vectors = np.stack([saved[p["hash"]] if p["hash"] in saved else encoded[p["hash"]]
+                                        for p in passages])
+                else:
+                    vectors = np.zeros((0, 0), dtype=np.float32)
+                self._save(passages, vectors)
+                logger.info(f"RAG index updated: {len(missing)} of {len(passages)} passages encoded")
+
+            self._state = (passages, {a["id"]: a for a in articles}, vectors)
+
+    def search_batch(self, queries: List[str], k: int = 3) -> List[List[Dict[str, Any]]]:
+        """Top-k статей для каждого запроса: лучший абзац статьи и его косинусная близость."""
+        passages, articles, vectors = self._state
+        if vectors is None or not passages or not queries:
+            return [[] for _ in queries]
+        scores = self._encode(queries) @ vectors.T
+        results = []
+        # Берем с запасом: у одной статьи может быть несколько близких абзацев
+        top = min(len(passages), k * 8)
+        for row in scores:
+            candidates = np.argpartition(-row, top - 1)[:top]
+            order = candidates[np.argsort(-row[candidates])]
+            hits, seen = [], set()
+            for i in order:
+                passage = passages[i]
+                if passage["article_id"] in seen:
+                    continue
+                seen.add(passage["article_id"])
+                hits.append({
+                    "article_id": passage["article_id"],
+                    "category": passage["category"],
+                    "text": passage["text"],
+                    "score": float(row[i]),
+                    "article": articles[passage["article_id"]],
+                })
+                if len(hits) == k:
+                    break
+            results.append(hits)
+        return results
+
+    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        return self.search_batch([query], k)[0]
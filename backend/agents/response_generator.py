@@ -17,4 +17,10 @@ class ResponseGenerator:
     
     def generate_llm_fallback(self, user_message: str) -> str:
         """Заглушка если LLM недоступен"""
-        return f"Запрос: '{user_message}' получен. В настоящее время AI сервис недоступен. Обратитесь к оператору."
\ No newline at end of file
+        return f"Запрос: '{user_message}' получен. В настоящее время AI сервис недоступен. Обратитесь к оператору."
+
+def generate_response(actions: List[Dict[str, Any]]) -> str:
+    """Ответ из плана действий: ответы статей по порядку или шаблон уточнения."""
+    generator = ResponseGenerator()
+    answers = [generator.generate_from_knowledge(action) for action in actions if action.get("answer")]
+    return "\n\n".join(answers) if answers else generator.templates["fallback"]
@@ -0,0 +1,105 @@
+"""Пакетная отправка тикетов в /tickets/batch.
+
+Пример:
+    python batch_cli.py ../requests.txt --url http://localhost:8000 -o results.jsonl
+
+Вход - текстовый файл (одно сообщение на строку) или JSONL с полями
+message и, опционально, user_id. Результаты пишутся в JSONL в порядке
+готовности; поле index - номер строки во входном файле.
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+from typing import List, Dict, Any, Iterator, TextIO
+
+import aiohttp
+
+
+def read_tickets(path: str, default_user: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                yield {"user_id": str(record.get("user_id", default_user)), "message": record["message"]}
+            else:
+                yield {"user_id": default_user, "message": line}
+
+
+def chunked(items: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk: List[Dict[str, Any]] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def send_chunk(session: aiohttp.ClientSession, url: str, chunk: List[Dict[str, Any]],
+                     offset: int, out: TextIO, sources: Counter):
+    async with session.post(f"{url}/tickets/batch", json={"tickets": chunk}) as r:
+        r.raise_for_status()
+        async for line in r.content:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            result["index"] += offset
+            sources[result["source"]] += 1
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+async def run(args) -> Counter:
+    sources: Counter = Counter()
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    slots = asyncio.Semaphore(args.parallel)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=args.timeout)
+    try:
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async def worker(chunk: List[Dict[str, Any]], offset: int):
+                try:
+                    await send_chunk(session, args.url, chunk, offset, out, sources)
+                finally:
+                    slots.release()
+
+            tasks = []
+            offset = 0
+            for chunk in chunked(read_tickets(args.input, args.user_id), args.chunk_size):
+                # Не читаем файл дальше, пока все слоты заняты - память ограничена
+                await slots.acquire()
+                tasks.append(asyncio.create_task(worker(chunk, offset)))
+                offset += len(chunk)
+            await asyncio.gather(*tasks)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная триажная обработка тикетов через /tickets/batch")
+    parser.add_argument("input", help="Файл с тикетами: .txt (строка - сообщение) или .jsonl")
+    parser.add_argument("--url", default="http://localhost:8000", help="Адрес бэкенда")
+    parser.add_argument("-o", "--output", help="Файл для результатов JSONL (по умолчанию stdout)")
+    parser.add_argument("--user-id", default="batch", help="user_id для строк без него")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Тикетов в одном запросе")
+    parser.add_argument("--parallel", type=int, default=2, help="Одновременных запросов к бэкенду")
+    parser.add_argument("--timeout", type=float, default=120, help="Макс. пауза между строками ответа, сек")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    sources = asyncio.run(run(args))
+    elapsed = time.monotonic() - started
+    total = sum(sources.values())
+    rate = total / elapsed * 60 if elapsed else 0.0
+    print(f"Processed {total} tickets in {elapsed:.1f}s ({rate:.0f}/min): {dict(sources)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
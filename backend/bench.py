@@ -0,0 +1,347 @@
+"""Нагрузочный тест бэкенда на тикетах из requests.txt.
+
+Два режима:
+    inprocess - запросы идут прямо в ASGI-приложение main.app, без сети;
+    http      - запросы идут на работающий сервер (--url).
+
+Вместо Ollama поднимается заглушка с настраиваемой задержкой, скоростью
+генерации токенов и долей ошибок. В режиме http сервер нужно запустить
+с OLLAMA_BASE_URLS, указывающим на заглушки; заглушку удобно поднять заранее
+отдельным процессом (--stub-only), чтобы монитор Ollama сразу видел ее живой.
+
+Примеры:
+    python bench.py --concurrency 16 --llm-latency 0.5 --llm-token-rate 20 -o bench.json
+    python bench.py --llm-down -o bench_no_llm.json
+    python bench.py --llm-nodes 3 --concurrency 32 -o bench_pool.json
+    python bench.py --stub-only --stub-port 11500 &
+    OLLAMA_BASE_URLS=http://127.0.0.1:11500 uvicorn main:app --port 8000 &
+    python bench.py --mode http --url http://localhost:8000 --llm-down
+
+Результат - JSON с параметрами прогона, общей пропускной способностью и
+перцентилями/гистограммой задержек по источнику ответа (knowledge_base,
+llm, cache, error, ...), чтобы сравнивать версии между собой.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+from typing import List, Dict, Any, Tuple, Optional
+
+import aiohttp
+from aiohttp import web
+
+DEFAULT_REQUESTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "requests.txt")
+# Границы корзин гистограммы, секунды
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+
+# --- Заглушка Ollama ---
+class OllamaStub:
+    """Минимальная Ollama: /api/tags и /api/chat (обычный и потоковый ответ)."""
+
+    def __init__(self, latency: float = 0.2, token_rate: float = 50.0, tokens: int = 60,
+                 failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._last_prompt = ""
+        self._runner: Optional[web.AppRunner] = None
+
+    async def tags(self, request: web.Request) -> web.Response:
+        return web.json_response({"models": [{"name": "stub"}]})
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.random.random() < self.failure_rate:
+            self.failures += 1
+            return web.json_response({"error": "stub failure"}, status=500)
+
+        # Длина ответа ограничена num_predict, как в настоящей Ollama
+        tokens = min(self.tokens, body.get("options", {}).get("num_predict") or self.tokens)
+        words = [f"слово{i}" for i in range(tokens)]
+        # Как llama.cpp: общий с предыдущим запросом префикс берется из KV-кэша и не считается
+        prompt = json.dumps(body["messages"], ensure_ascii=False)
+        cached = len(os.path.commonprefix([prompt, self._last_prompt]))
+        self._last_prompt = prompt
+        stats = {"eval_count": tokens, "eval_duration": int(tokens / self.token_rate * 1e9),
+                 "prompt_eval_count": (len(prompt) - cached) // 4}
+        self.prompt_tokens += stats["prompt_eval_count"]
+        self.completion_tokens += tokens
+        if not body.get("stream"):
+            await asyncio.sleep(tokens / self.token_rate)
+            return web.json_response({"message": {"role": "assistant", "content": " ".join(words)}, "done": True, **stats})
+
+        response = web.StreamResponse()
+        response.content_type = "application/x-ndjson"
+        await response.prepare(request)
+        for word in words:
+            await asyncio.sleep(1 / self.token_rate)
+            chunk = {"message": {"role": "assistant", "content": word + " "}, "done": False}
+            await response.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode())
+        await response.write((json.dumps({"message": {"content": ""}, "done": True, **stats}) + "\n").encode())
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/tags", self.tags)
+        app.router.add_post("/api/chat", self.chat)
+        return app
+
+    async def start(self, port: int) -> str:
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+# --- Клиенты ---
+async def asgi_post(app, path: str, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """POST в ASGI-приложение без сети и без сторонних зависимостей."""
+    body = json.dumps(payload).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("bench", 0), "server": ("bench", 80),
+    }
+    incoming = [{"type": "http.request", "body": body, "more_body": False}]
+    status = 0
+    chunks: List[bytes] = []
+
+    async def receive():
+        if incoming:
+            return incoming.pop(0)
+        # Клиент не отключается, пока приложение не ответит
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, json.loads(b"".join(chunks) or b"{}")
+
+
+class InProcessTarget:
+    def __init__(self, ollama_url: str):
+        # Конфиг main.py читается при импорте, поэтому окружение готовим заранее
+        os.environ["OLLAMA_BASE_URLS"] = ollama_url
+        os.environ.setdefault("TICKETS_DB_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+        os.environ.setdefault("RAG_ENABLED", "0")
+        # 100 синтетических пользователей шлют тикеты быстрее любого живого: их лимит мерил бы не то
+        os.environ.setdefault("USER_RATE_LIMIT", "0")
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import main
+        self.main = main
+
+    async def start(self):
+        await self.main.app.router.startup()
+        # Даем монитору Ollama сделать первую проверку
+        for _ in range(50):
+            if self.main.llm_monitor.state != self.main.llm_monitor.UNKNOWN:
+                break
+            await asyncio.sleep(0.02)
+
+    async def stop(self):
+        await self.main.app.router.shutdown()
+
+    async def post(self, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        return await asgi_post(self.main.app, "/tickets/", payload)
+
+
+class HttpTarget:
+    def __init__(self, url: str, timeout: float):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    async def stop(self):
+        await self.session.close()
+
+    async def post(self, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        async with self.session.post(f"{self.url}/tickets/", json=payload) as r:
+            return r.status, await r.json()
+
+
+# --- Статистика ---
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Метод ближайшего ранга
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], wall: float) -> Dict[str, Any]:
+    values = sorted(latencies)
+    histogram = {f"le_{b}": sum(1 for v in values if v <= b) for b in BUCKETS}
+    histogram["le_inf"] = len(values)
+    return {
+        "count": len(values),
+        "throughput_rps": round(len(values) / wall, 2) if wall else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p90_ms": round(percentile(values, 90) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+        "histogram": histogram,
+    }
+
+
+async def replay(target, messages: List[str], concurrency: int) -> Tuple[Dict[str, List[float]], float]:
+    by_path: Dict[str, List[float]] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for i, message in enumerate(messages):
+        queue.put_nowait((i, message))
+
+    async def worker():
+        while not queue.empty():
+            i, message = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                status, data = await target.post({"user_id": f"bench_{i % 100}", "message": message})
+                path = data.get("source", "unknown") if status == 200 else f"http_{status}"
+            except Exception:
+                path = "client_error"
+            by_path.setdefault(path, []).append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return by_path, time.perf_counter() - started
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    with open(args.requests_file, encoding="utf-8") as f:
+        messages = [line.strip() for line in f if line.strip()]
+    messages = (messages * args.repeat)[:args.limit] if args.limit else messages * args.repeat
+    if args.shuffle:
+        random.Random(args.seed).shuffle(messages)
+
+    stubs = [OllamaStub(args.llm_latency, args.llm_token_rate, args.llm_tokens, args.llm_failure_rate, args.seed + i)
+             for i in range(args.llm_nodes)]
+    ollama_url = "http://127.0.0.1:9"  # заведомо закрытый порт для --llm-down
+    if not args.llm_down:
+        # Каждый узел пула - отдельная заглушка на следующем порту
+        ollama_url = ",".join([await stub.start(args.stub_port + i) for i, stub in enumerate(stubs)])
+
+    target = InProcessTarget(ollama_url) if args.mode == "inprocess" else HttpTarget(args.url, args.timeout)
+    await target.start()
+    try:
+        by_path, wall = await replay(target, messages, args.concurrency)
+    finally:
+        await target.stop()
+        for stub in stubs:
+            await stub.stop()
+
+    all_latencies = [v for values in by_path.values() for v in values]
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "mode": args.mode,
+            "requests": len(messages),
+            "concurrency": args.concurrency,
+            "llm": None if args.llm_down else {
+                "latency": args.llm_latency, "token_rate": args.llm_token_rate,
+                "tokens": args.llm_tokens, "failure_rate": args.llm_failure_rate, "nodes": args.llm_nodes,
+                "calls": sum(stub.calls for stub in stubs), "failures": sum(stub.failures for stub in stubs),
+                "calls_per_node": [stub.calls for stub in stubs],
+                "prompt_tokens": sum(stub.prompt_tokens for stub in stubs),
+                "completion_tokens": sum(stub.completion_tokens for stub in stubs),
+            },
+        },
+        "total": summarize(all_latencies, wall),
+        "paths": {path: summarize(values, wall) for path, values in sorted(by_path.items())},
+        "wall_seconds": round(wall, 3),
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    rows = [("total", report["total"])] + list(report["paths"].items())
+    print(f"{'path':<16}{'count':>8}{'rps':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, s in rows:
+        print(f"{name:<16}{s['count']:>8}{s['throughput_rps']:>10}{s['p50_ms']:>10}"
+              f"{s['p90_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}")
+    llm = report["meta"]["llm"]
+    if llm and llm["calls"]:
+        print(f"LLM calls: {llm['calls']}, tokens per call: prompt {llm['prompt_tokens'] / llm['calls']:.0f}, "
+              f"completion {llm['completion_tokens'] / llm['calls']:.0f}")
+        if len(llm["calls_per_node"]) > 1:
+            print(f"LLM calls per node: {llm['calls_per_node']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /tickets/ на данных requests.txt")
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", default="http://localhost:8000", help="Адрес сервера для --mode http")
+    parser.add_argument("--requests-file", default=DEFAULT_REQUESTS_FILE)
+    parser.add_argument("--limit", type=int, default=0, help="Сколько тикетов отправить (0 - все)")
+    parser.add_argument("--repeat", type=int, default=1, help="Сколько раз повторить файл")
+    parser.add_argument("--shuffle", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--stub-port", type=int, default=11500, help="Порт заглушки Ollama")
+    parser.add_argument("--stub-only", action="store_true", help="Только запустить заглушку Ollama и ждать")
+    parser.add_argument("--llm-down", action="store_true", help="Не поднимать заглушку (Ollama недоступна или внешняя)")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Задержка до первого токена, сек")
+    parser.add_argument("--llm-token-rate", type=float, default=50.0, help="Токенов в секунду")
+    parser.add_argument("--llm-tokens", type=int, default=60, help="Длина ответа в токенах")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--llm-nodes", type=int, default=1, help="Сколько заглушек Ollama поднять (пул OLLAMA_BASE_URLS)")
+    parser.add_argument("-o", "--output", help="Куда сохранить JSON-отчет")
+    args = parser.parse_args()
+
+    if args.stub_only:
+        stub = OllamaStub(args.llm_latency, args.llm_token_rate, args.llm_tokens, args.llm_failure_rate, args.seed)
+        web.run_app(stub.app(), host="127.0.0.1", port=args.stub_port)
+        return
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from typing import Dict, List, Any, Optional, Callable, Awaitable, Hashable, TypeVar
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+LLM_QUEUE_SECONDS = registry.histogram(
+    "llm_queue_wait_seconds", "Ожидание свободного слота Ollama", ("priority",))
+LLM_SCHEDULED_TOTAL = registry.counter(
+    "llm_scheduled_total", "Запросы к LLM: upstream - ушел в Ollama, coalesced - присоединился к такому же, "
+    "busy - очередь полна или ожидание дольше лимита, shed - не встал в очередь из-за ожидаемой задержки", ("outcome",))
+LLM_NODE_REQUESTS = registry.counter(
+    "llm_node_requests_total", "Вызовы узлов пула Ollama по исходу", ("node", "outcome"))
+
+
+class LLMBusy(Exception):
+    """LLM не взял запрос: очередь заполнена или ожидание превысило лимит."""
+
+
+class PrioritySlots:
+    """Ограничение одновременных запросов к LLM с очередью по приоритету.
+
+    Освободившийся слот получает ожидающий с наименьшим
+    arrival + priority * priority_delay: короткие тикеты (priority 0) обгоняют
+    обычные, но обычный, прождавший дольше priority_delay, все равно пройдет
+    раньше нового короткого. Ожидание ограничено timeout секундами, после
+    чего acquire бросает LLMBusy.
+    """
+
+    def __init__(self, limit: int, queue_size: int, priority_delay: float, timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.priority_delay = priority_delay
+        self.timeout = timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self._heap: List[Any] = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int = 1, timeout: Optional[float] = None):
+        """Ждет слот не дольше timeout (по умолчанию self.timeout) секунд."""
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        if self.in_flight < self.limit and self.queued == 0:
+            self.in_flight += 1
+            LLM_QUEUE_SECONDS.observe(0.0, priority=priority)
+            return
+        if self.queued >= self.queue_size:
+            self.rejected += 1
+            LLM_SCHEDULED_TOTAL.inc(outcome="busy")
+            raise LLMBusy(f"LLM queue is full ({self.queued} waiting)")
+
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (started + priority * self.priority_delay, next(self._seq), waiter))
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже передан нам, но ждать его некому - отдаем следующему
+                self.release()
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                LLM_SCHEDULED_TOTAL.inc(outcome="busy")
+                raise LLMBusy(f"LLM queue wait exceeded {timeout:.1f}s") from None
+            raise
+        finally:
+            self.queued -= 1
+        LLM_QUEUE_SECONDS.observe(time.monotonic() - started, priority=priority)
+
+    def _wake_next(self) -> bool:
+        while self._heap:
+            _, _, waiter = heapq.heappop(self._heap)
+            # Отмененные (по таймауту) ожидающие остаются в куче и пропускаются здесь
+            if not waiter.done():
+                waiter.set_result(None)
+                return True
+        return False
+
+    def release(self):
+        # После уменьшения лимита слот не передается, пока занятых не станет меньше limit
+        if self.in_flight > self.limit or not self._wake_next():
+            self.in_flight -= 1
+
+    def ahead(self, priority: int = 1) -> int:
+        """Сколько ожидающих получат слот раньше запроса с этим приоритетом, пришедшего сейчас."""
+        key = time.monotonic() + priority * self.priority_delay
+        return sum(1 for k, _, waiter in self._heap if k <= key and not waiter.done())
+
+    def resize(self, limit: int):
+        """Меняет лимит на лету: например, когда узел LLM выпал из пула или вернулся."""
+        self.limit = limit
+        while self.in_flight < self.limit and self._wake_next():
+            self.in_flight += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+        }
+
+
+class Coalescer:
+    """Объединяет одинаковые запросы: пока первый выполняется, остальные ждут его результат.
+
+    Запрос выполняется отдельной задачей, поэтому отключение клиента, который
+    его начал, не обрывает ответ для присоединившихся. Ожидающие считаются
+    по задаче: когда отменен последний из них, отменяется и сам запрос -
+    он не ждет слота и не уходит в Ollama, если ответ больше никому не нужен.
+    """
+
+    def __init__(self):
+        self._running: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.merged = 0
+        self.cancelled = 0
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._running.get(key) is task:
+            del self._running[key]
+        if not task.cancelled():
+            # Исключение забирают ожидающие; если их не осталось - не пишем предупреждение в лог
+            task.exception()
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        task = self._running.get(key)
+        if task is None:
+            task = asyncio.create_task(call())
+            self._running[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+            LLM_SCHEDULED_TOTAL.inc(outcome="upstream")
+        else:
+            self.merged += 1
+            LLM_SCHEDULED_TOTAL.inc(outcome="coalesced")
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            left = self._waiters.pop(task) - 1
+            if left:
+                self._waiters[task] = left
+            elif not task.done():
+                # Сюда попадаем только при отмене ожидающего: других ожидающих нет
+                task.cancel()
+                self.cancelled += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": len(self._running), "merged": self.merged, "cancelled": self.cancelled}
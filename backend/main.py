@@ -1,17 +1,100 @@
 import os
+import json
 import uuid
+import asyncio
 import logging
+import time
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator, Iterable, Iterator, Tuple, Callable, Awaitable
 
-import requests
-from fastapi import FastAPI
+import aiohttp
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+from agents.kb_index import KnowledgeIndex, directory_signature
+from agents.matcher import KeywordMatcher
+from agents.ml_classifier import TicketClassifier, get_default as get_ticket_model
+from agents.orchestrator import Orchestrator, FunctionStage, TicketContext
+from agents.rag_search import EmbeddingRetriever
+from metrics import (
+    registry as metrics_registry, stage, start_trace, current_trace, record_llm_stats,
+    TICKETS_TOTAL, TICKET_SECONDS,
+)
+from llm_scheduler import LLMBusy, PrioritySlots, Coalescer, LLM_NODE_REQUESTS, LLM_SCHEDULED_TOTAL
+from prompt_builder import build_prompt, LLM_NUM_CTX
+from response_cache import ResponseCache, normalize_text
+from sessions import Session, SessionStore
+from warmup import Warmup, Component
+from admission import AdmissionController, Rejected
+from payloads import ArticlePayload, build_payloads, payload_stats, accepts_gzip, dumps as json_dumps
+from storage import TicketStore, HISTORY_FIELDS
 
 # --- Конфиг ---
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "phi3:mini")
+# Пул экземпляров Ollama через запятую (по умолчанию - один OLLAMA_BASE_URL)
+OLLAMA_BASE_URLS = [url.strip().rstrip("/") for url in os.getenv("OLLAMA_BASE_URLS", OLLAMA_BASE_URL).split(",")
+                    if url.strip()]
+# Более крупная модель на случай, когда OLLAMA_MODEL не ответила ни на одном узле ("" - без нее)
+OLLAMA_FALLBACK_MODEL = os.getenv("OLLAMA_FALLBACK_MODEL", "")
+# Сколько раз повторить запрос на другом узле после ошибки
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "1"))
+# Сколько запросов одновременно уходит в каждый узел Ollama и сколько может ждать в общей очереди
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+OLLAMA_QUEUE_SIZE = int(os.getenv("OLLAMA_QUEUE_SIZE", "32"))
+# Сколько секунд тикет может ждать слота Ollama, прежде чем ответить без LLM
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))
+# Если по очереди и задержке узлов ждать слота дольше max(LLM_SHED_WAIT, LLM_SHED_FACTOR * задержка узла),
+# тикет не встает в очередь, а сразу отвечается без LLM. Порог растет с замеренной задержкой: на CPU, где ответ
+# идет 20с и дольше, иначе отбрасывалось бы все, что не попало в слот сразу. Сверху порог ограничен
+# LLM_QUEUE_TIMEOUT и остатком LLM_TOTAL_TIMEOUT за вычетом ответа узла: иначе тикет только дождался бы таймаута
+LLM_SHED_WAIT = float(os.getenv("LLM_SHED_WAIT", str(LLM_QUEUE_TIMEOUT / 2)))
+LLM_SHED_FACTOR = float(os.getenv("LLM_SHED_FACTOR", "2"))
+# Лимит одной попытки и всего вызова LLM с очередью и повторами (меньше proxy_read_timeout nginx в 60с)
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "30"))
+LLM_TOTAL_TIMEOUT = float(os.getenv("LLM_TOTAL_TIMEOUT", "45"))
+# Фора в очереди на каждый уровень приоритета: короткие тикеты (0), обычные (1), пакетные (2)
+LLM_PRIORITY_DELAY = float(os.getenv("LLM_PRIORITY_DELAY", "5"))
+LLM_SHORT_MESSAGE = int(os.getenv("LLM_SHORT_MESSAGE", "80"))
+# При перегрузке LLM отвечать статьей базы знаний или шаблоном с source=degraded (иначе - сообщением об ошибке)
+LLM_BUSY_KB_FALLBACK = os.getenv("LLM_BUSY_KB_FALLBACK", "1") == "1"
+# Фоновая проверка доступности Ollama
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_HEALTH_MAX_INTERVAL = float(os.getenv("OLLAMA_HEALTH_MAX_INTERVAL", "120"))
+OLLAMA_DEGRADED_LATENCY = float(os.getenv("OLLAMA_DEGRADED_LATENCY", "2.0"))
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "3"))
+# Сколько секунд Ollama держит модель в памяти после запроса
+OLLAMA_KEEP_ALIVE = int(os.getenv("OLLAMA_KEEP_ALIVE", "300"))
+# База знаний: каталог со статьями и период проверки изменений (0 - не следить)
+KB_DIR = os.getenv("KB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge"))
+KB_RELOAD_INTERVAL = float(os.getenv("KB_RELOAD_INTERVAL", "5"))
+# Минимальная BM25-оценка статьи, которую надежная категория выбирает без триггеров: одна общая основа
+# слова или одни служебные слова ("и", "не", "при") дают оценку около 1-2, а это не ответ на тикет
+KB_TRUSTED_MIN_SCORE = float(os.getenv("KB_TRUSTED_MIN_SCORE", "3.0"))
+# Поиск по эмбеддингам: порог для прямого ответа статьей и для попадания абзаца в контекст LLM
+RAG_ENABLED = os.getenv("RAG_ENABLED", "1") == "1"
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "3"))
+RAG_DIRECT_SCORE = float(os.getenv("RAG_DIRECT_SCORE", "0.8"))
+RAG_CONTEXT_SCORE = float(os.getenv("RAG_CONTEXT_SCORE", "0.4"))
+RAG_TIMEOUT = float(os.getenv("RAG_TIMEOUT", "2.0"))
+# Пакетная обработка: максимум тикетов в запросе и параллельных обращений к LLM на пакет
+TICKETS_BATCH_MAX = int(os.getenv("TICKETS_BATCH_MAX", "5000"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", str(OLLAMA_MAX_CONCURRENCY * len(OLLAMA_BASE_URLS))))
+# Через сколько групп тикетов пакет уступает цикл событий другим запросам
+BATCH_YIELD_EVERY = int(os.getenv("BATCH_YIELD_EVERY", "50"))
+# Обученный классификатор (train_classifier.py) заменяет ключевые слова, если уверен не меньше чем на CLASSIFIER_MIN_CONFIDENCE
+CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("CLASSIFIER_MIN_CONFIDENCE", "0.5"))
+# С такой уверенностью статья категории ищется и без совпадения триггеров
+CLASSIFIER_KB_CONFIDENCE = float(os.getenv("CLASSIFIER_KB_CONFIDENCE", "0.8"))
+# Максимальный размер страницы /tickets/history
+TICKETS_PAGE_MAX = int(os.getenv("TICKETS_PAGE_MAX", "1000"))
+# Кэш ответов LLM
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.9"))
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,6 +118,9 @@ class TicketRequest(BaseModel):
     user_id: str
     message: str
 
+class TicketBatchRequest(BaseModel):
+    tickets: List[TicketRequest]
+
 class TicketResponse(BaseModel):
     ticket_id: str
     response: str
@@ -43,6 +129,8 @@ class TicketResponse(BaseModel):
     source: str = "knowledge_base"
     needs_human: bool = False
     solution_steps: Optional[List[str]] = None
+    # Токены Ollama на этот тикет: prompt, completion, estimated (только для ответов LLM)
+    tokens: Optional[Dict[str, int]] = None
 
 
 # --- Классификатор ---
@@ -57,11 +145,49 @@ class SimpleClassifier:
         "other": []  # ← добавил категорию other
     }
 
-    def classify(self, message: str) -> Dict[str, Any]:
-        msg = message.lower()
-        scores = {}
+    def __init__(self, matcher: Optional[KeywordMatcher] = None, model: Optional[TicketClassifier] = None):
+        self.matcher = matcher or KeywordMatcher(self.vocabulary())
+        self._model = model
+        # ключевое слово -> категории, в которых оно встречается
+        self.keyword_categories: Dict[str, List[str]] = {}
         for cat, keywords in self.KEYWORDS.items():
-            scores[cat] = sum(k in msg for k in keywords)
+            for k in keywords:
+                self.keyword_categories.setdefault(k, []).append(cat)
+
+    @classmethod
+    def vocabulary(cls) -> set:
+        return {k for keywords in cls.KEYWORDS.values() for k in keywords}
+
+    @property
+    def model(self) -> Optional[TicketClassifier]:
+        # Модель грузится один раз на воркер в фоне; до загрузки работают ключевые слова
+        if self._model is None:
+            warmup.ensure("classifier")
+            self._model = get_ticket_model(wait=False)
+        return self._model
+
+    def classify(self, message: str, matches: Optional[set] = None) -> Dict[str, Any]:
+        return self.classify_batch([message], [matches])[0]
+
+    def classify_batch(self, messages: List[str], matches: Optional[List[Optional[set]]] = None) -> List[Dict[str, Any]]:
+        """Обученная модель, а где она не уверена - подсчет ключевых слов."""
+        matches = matches or [None] * len(messages)
+        results = [self.classify_keywords(m, mt) for m, mt in zip(messages, matches)]
+        model = self.model
+        if model is None:
+            return results
+        for i, predicted in enumerate(model.classify_batch(messages)):
+            if predicted["confidence"] >= CLASSIFIER_MIN_CONFIDENCE or results[i]["category"] == "other":
+                results[i] = predicted
+        return results
+
+    def classify_keywords(self, message: str, matches: Optional[set] = None) -> Dict[str, Any]:
+        if matches is None:
+            matches = self.matcher.find(message)
+        scores = dict.fromkeys(self.KEYWORDS, 0)
+        for k in matches:
+            for cat in self.keyword_categories.get(k, ()):
+                scores[cat] += 1
         
         # Если максимальный score = 0, то категория "other"
         category = max(scores.items(), key=lambda x: x[1])[0]
@@ -74,220 +200,741 @@ class SimpleClassifier:
         return {"category": category, "confidence": confidence}
 # --- База знаний ---
 class SimpleKnowledgeBase:
-    SOLUTIONS = {
-        "password_reset": {
-            "triggers": ["пароль", "password", "сброс пароля", "забыл пароль", "восстановление пароля", "логин", "вход", "учетная запись"],
-            "answer": """Для сброса пароля:
-
-1. Перейдите на portal.rosatom.ru/password-reset
-2. Введите корпоративный email
-3. Подтвердите личность через СМС
-4. Установите новый пароль
-
-Если проблемы сохраняются, обратитесь в службу поддержки по телефону +7 (495) 123-45-67.""",
-            "steps": ["Перейти на портал сброса пароля", "Ввести email", "Подтвердить через СМС", "Установить новый пароль"],
-            "confidence": 0.9
-        },
-        "hardware": {
-            "triggers": ["принтер", "печать", "не печатает", "монитор", "компьютер", "оборудование", "клавиатура", "мышь", "картридж", "тонер"],
-            "answer": """Устранение проблем с принтером:
-
-1. Проверьте подключение кабелей питания и USB
-2. Убедитесь, что принтер включен и нет ошибок на дисплее
-3. Проверьте наличие бумаги и картриджа
-4. Очистите очередь печати (Панель управления > Устройства > Принтеры)
-5. Переустановите драйверы с официального сайта
-
-Для сложных случаев создайте заявку в ITSM.""",
-            "steps": ["Проверить подключение", "Проверить питание и бумагу", "Очистить очередь печати", "Переустановить драйверы"],
-            "confidence": 0.8
-        },
-        "software": {
-            "triggers": ["почта", "email", "outlook", "программа", "софт", "установка", "удаление", "обновление", "office", "windows"],
-            "answer": """Решение проблем с почтой:
-
-1. Проверьте подключение к интернету
-2. Перезапустите Outlook
-3. Проверьте настройки учетной записи
-4. Очистите кеш приложения
-5. При необходимости переустановите программу
-
-Для корпоративного ПО используйте центр установки программ.""",
-            "steps": ["Проверить интернет", "Перезапустить приложение", "Проверить настройки", "Очистить кеш"],
-            "confidence": 0.8
-        },
-        "network": {
-            "triggers": ["интернет", "сеть", "vpn", "wi-fi", "wifi", "подключение", "кабель", "локальная сеть", "интернет не работает"],
-            "answer": """Решение сетевых проблем:
-
-1. Проверьте подключение кабеля Ethernet
-2. Перезагрузите роутер/коммутатор
-3. Проверьте настройки VPN подключения
-4. Убедитесь, что Wi-Fi адаптер включен
-5. Запустите диагностику сети (правый клик на значке сети)
-
-Для доступа к корпоративной сети используйте Cisco AnyConnect VPN.""",
-            "steps": ["Проверить физическое подключение", "Перезагрузить оборудование", "Проверить настройки VPN", "Запустить диагностику"],
-            "confidence": 0.8
-        },
-        "access_issues": {
-            "triggers": ["доступ", "access", "войти", "авторизация", "permission", "права доступа", "система недоступна", "доступ запрещен"],
-            "answer": """Решение проблем с доступом:
-
-1. Проверьте корректность логина и пароля
-2. Убедитесь, что учетная запись активна
-3. Проверьте подключение к корпоративной сети
-4. Очистите кеш браузера
-5. Попробуйте другой браузер
-
-Если проблема сохраняется, обратитесь к системному администратору.""",
-            "steps": ["Проверить логин/пароль", "Проверить активность учетной записи", "Очистить кеш браузера", "Попробовать другой браузер"],
-            "confidence": 0.8
-        },
-        "greeting": {
-            "triggers": ["привет", "здравствуй", "hello", "hi", "добрый", "начать", "помощь", "help"],
-            "answer": """Добро пожаловать в службу технической поддержки Росатом! 🤖
-
-Я помогу вам с:
-- Сбросом и восстановлением паролей
-- Проблемами с доступом к системам
-- Оборудованием (принтеры, компьютеры)
-- Программным обеспечением
-- Сетевыми подключениями
-
-Опишите вашу проблему, и я постараюсь помочь!""",
-            "steps": [],
-            "confidence": 0.95
-        }
-    }
+    """База знаний из YAML/JSON файлов каталога KB_DIR.
+
+    Кандидаты отбираются по триггерам (один проход автомата), а среди
+    нескольких кандидатов лучшая статья выбирается по BM25. Изменения
+    файлов подхватываются фоновой задачей: новый индекс строится в потоке
+    и подменяет старый одной ссылкой, запросы при этом не ждут. Вместе с
+    индексом собираются готовые тела ответов статьями (ArticlePayload).
+    """
+
+    GREETING_WORDS = ["привет", "здравствуй", "hello", "hi", "добрый"]
+
+    def __init__(self, path: str = KB_DIR, extra_vocabulary: Iterable[str] = ()):
+        self.path = path
+        self.extra_vocabulary = set(extra_vocabulary) | set(self.GREETING_WORDS)
+        self._signature = directory_signature(path)
+        self.index, self.payloads = self._load()
+        self._task: Optional[asyncio.Task] = None
+        # Вызываются после подмены индекса (например, для пересчета эмбеддингов)
+        self.listeners: List[Callable[[KnowledgeIndex], Awaitable[None]]] = []
+
+    def _load(self) -> Tuple[KnowledgeIndex, Dict[str, ArticlePayload]]:
+        index = KnowledgeIndex.from_directory(self.path, self.extra_vocabulary)
+        return index, build_payloads(index.articles)
+
+    @property
+    def matcher(self) -> KeywordMatcher:
+        return self.index.matcher
+
+    def payload(self, article: Dict[str, Any]) -> Optional[ArticlePayload]:
+        """Готовое тело ответа статьей; None, если статья из уже замененного индекса."""
+        payload = self.payloads.get(article["id"])
+        return payload if payload is not None and payload.article is article else None
+
+    def search(self, message: str, category: str, matches: Optional[set] = None,
+               trusted: bool = False) -> Optional[Dict[str, Any]]:
+        """Статья по триггерам; trusted - категорию дал уверенный классификатор."""
+        index = self.index
+        if matches is None:
+            matches = index.matcher.find(message)
+        triggered = index.triggered(matches)
+
+        # Сначала ищем совпадение по категории
+        in_category = [i for i in triggered if index.articles[i]["category"] == category]
+        if in_category:
+            return index.articles[index.best(message, in_category)]
+
+        # Если не нашли по категории, ищем по всем триггерам.
+        # Для greeting возвращаем только при явных приветствиях
+        greeting = any(word in matches for word in self.GREETING_WORDS)
+        candidates = [i for i in triggered if greeting or index.articles[i]["category"] != "greeting"]
+        if candidates:
+            return index.articles[index.best(message, candidates)]
+
+        # Триггеров нет, но категория надежна: лучшая по BM25 статья категории, если она достаточно похожа
+        if trusted and category != "greeting":
+            scores = index.bm25(message, index.by_category.get(category, []))
+            if scores:
+                best = max(scores, key=scores.get)
+                if scores[best] >= KB_TRUSTED_MIN_SCORE:
+                    return index.articles[best]
 
-    def search(self, message: str, category: str) -> Optional[Dict[str, Any]]:
-        msg = message.lower().strip()
-        
-        # Сначала ищем точное совпадение по категории
-        solution = self.SOLUTIONS.get(category)
-        if solution:
-            # Проверяем триггеры для этой категории
-            triggers = solution.get("triggers", [])
-            if any(trigger in msg for trigger in triggers):
-                return solution
-        
-        # Если не нашли по категории, ищем по всем триггерам
-        for solution_cat, solution_data in self.SOLUTIONS.items():
-            if solution_cat == category:  # Уже проверяли
-                continue
-                
-            triggers = solution_data.get("triggers", [])
-            # Требуем более строгого соответствия
-            matched_triggers = [trigger for trigger in triggers if trigger in msg]
-            
-            # Возвращаем решение только если есть значимое совпадение
-            if len(matched_triggers) > 0:
-                # Для greeting возвращаем только при явных приветствиях
-                if solution_cat == "greeting":
-                    greeting_words = ["привет", "здравствуй", "hello", "hi", "добрый"]
-                    if any(word in msg for word in greeting_words):
-                        return solution_data
-                else:
-                    return solution_data
-        
         return None
 
+    async def reload_if_changed(self) -> bool:
+        signature = await asyncio.to_thread(directory_signature, self.path)
+        if signature == self._signature:
+            return False
+        # Запоминаем снимок заранее: битый файл не перечитываем, пока его не исправят
+        self._signature = signature
+        index, payloads = await asyncio.to_thread(self._load)
+        self.index, self.payloads = index, payloads
+        logger.info(f"Knowledge base reloaded: {len(index.articles)} articles")
+        for listener in self.listeners:
+            await listener(index)
+        return True
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(KB_RELOAD_INTERVAL)
+            try:
+                await self.reload_if_changed()
+            except Exception as e:
+                # Битый файл не должен ронять сервис: продолжаем со старым индексом
+                logger.error(f"Knowledge base reload failed: {e}")
+
+    def start(self):
+        if KB_RELOAD_INTERVAL > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
 # --- LLM ---
+class OllamaNode:
+    """Один экземпляр Ollama в пуле LLMClient.
+
+    Хранит свою нагрузку (outstanding - запросы, ушедшие на узел и еще
+    не вернувшиеся), скользящую среднюю времени ответа и свой монитор
+    доступности: упавший узел выпадает из маршрутизации, не задевая остальные.
+    """
+
+    LATENCY_ALPHA = 0.2
+
+    def __init__(self, base_url: str, client: "LLMClient"):
+        self.base_url = base_url
+        self.client = client
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.latency: Optional[float] = None
+        # Когда модель последний раз отвечала на этом узле: Ollama выгружает каждую модель
+        # через OLLAMA_KEEP_ALIVE независимо от других
+        self.last_used: Dict[str, float] = {}
+        self.monitor = OllamaMonitor(self)
+
+    async def is_available(self) -> bool:
+        try:
+            session = await self.client._get_session()
+            async with session.get(f"{self.base_url}/api/tags", timeout=aiohttp.ClientTimeout(total=5)) as r:
+                return r.status == 200
+        except Exception:
+            return False
+
+    def is_warm(self, model: str) -> bool:
+        # С запасом: модель могла выгрузиться чуть раньше по часам Ollama
+        last_used = self.last_used.get(model)
+        return last_used is not None and time.monotonic() - last_used < OLLAMA_KEEP_ALIVE * 0.8
+
+    def record(self, ok: bool, seconds: float, model: str):
+        self.requests += 1
+        if ok:
+            self.latency = seconds if self.latency is None else self.latency + self.LATENCY_ALPHA * (seconds - self.latency)
+            self.last_used[model] = time.monotonic()
+            self.monitor.record_success()
+        else:
+            self.failures += 1
+            self.monitor.record_failure()
+        LLM_NODE_REQUESTS.inc(node=self.base_url, outcome="ok" if ok else "error")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.base_url,
+            "state": self.monitor.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ms": None if self.latency is None else round(self.latency * 1000, 1),
+        }
+
+
 class LLMClient:
-    def __init__(self):
-        self.base_url = OLLAMA_BASE_URL
+    """Асинхронный клиент пула Ollama с общим keep-alive пулом соединений.
+
+    Каждый узел из OLLAMA_BASE_URLS получает не больше OLLAMA_MAX_CONCURRENCY
+    запросов; остальные ждут в общей очереди длиной OLLAMA_QUEUE_SIZE в порядке
+    приоритета (см. PrioritySlots), а емкость очереди следует за числом живых
+    узлов. Запрос уходит на доступный узел с наименьшим ожидаемым временем
+    ответа: (outstanding + 1) * средняя задержка узла. После ошибки запрос
+    повторяется на другом узле (до OLLAMA_RETRIES раз), а затем, если задана
+    OLLAMA_FALLBACK_MODEL, - запасной моделью.
+
+    Одинаковые запросы (нормализованный текст и контекст), пришедшие, пока
+    первый ждет или выполняется, не уходят в Ollama повторно, а получают его
+    ответ. Если очередь заполнена, ожидание дольше LLM_QUEUE_TIMEOUT или
+    ожидаемое ожидание (expected_wait) дольше shed_wait, бросается
+    LLMBusy. Весь вызов вместе с очередью и повторами укладывается в
+    LLM_TOTAL_TIMEOUT: новая попытка после него не начинается.
+    """
+
+    def __init__(self, base_urls: Optional[List[str]] = None):
+        self.nodes = [OllamaNode(url, self) for url in (base_urls or OLLAMA_BASE_URLS)]
         self.model = OLLAMA_MODEL
+        self.fallback_model = OLLAMA_FALLBACK_MODEL or None
+        self.retries = OLLAMA_RETRIES
+        self.max_concurrency = OLLAMA_MAX_CONCURRENCY
+        self.queue_size = OLLAMA_QUEUE_SIZE
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._slots = PrioritySlots(self.capacity(), self.queue_size, LLM_PRIORITY_DELAY, LLM_QUEUE_TIMEOUT)
+        self._coalescer = Coalescer()
+        self._warm_task: Optional[asyncio.Task] = None
+        self.shed = 0
 
-    def is_available(self) -> bool:
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=(self.max_concurrency + 2) * len(self.nodes), keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self):
+        if self._warm_task is not None:
+            self._warm_task.cancel()
+            self._warm_task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    def capacity(self) -> int:
+        # Узлы в состоянии down слотов не дают; непроверенные (unknown) считаются живыми
+        alive = sum(1 for node in self.nodes if node.monitor.state != OllamaMonitor.DOWN)
+        return self.max_concurrency * max(alive, 1)
+
+    def pick_node(self, exclude: Iterable[OllamaNode] = ()) -> Optional[OllamaNode]:
+        """Доступный узел с наименьшим ожидаемым временем ответа, None - если таких нет."""
+        excluded = set(exclude)
+        candidates = [node for node in self.nodes if node not in excluded and node.monitor.is_available()]
+        if not candidates:
+            return None
+        # Узел без замеров оцениваем по самому быстрому известному, чтобы он тоже получал запросы
+        default = min((node.latency for node in self.nodes if node.latency is not None), default=1.0)
+        return min(candidates, key=lambda node: (
+            (node.outstanding + 1) * (node.latency if node.latency is not None else default),
+            node.outstanding, node.requests,
+        ))
+
+    def _attempts(self) -> Iterator[Tuple[OllamaNode, str]]:
+        """Узлы и модели по порядку попыток; следующий узел выбирается после неудачи предыдущего."""
+        tried: List[OllamaNode] = []
+        for _ in range(1 + self.retries):
+            node = self.pick_node(exclude=tried)
+            if node is None:
+                break
+            tried.append(node)
+            yield node, self.model
+        if self.fallback_model:
+            node = self.pick_node()
+            if node is not None:
+                yield node, self.fallback_model
+
+    def mean_latency(self) -> float:
+        """Средняя задержка ответа живых узлов; пока замеров нет, как и в pick_node, - секунда."""
+        latencies = [node.latency for node in self.nodes if node.latency is not None and node.monitor.is_available()]
+        return sum(latencies) / len(latencies) if latencies else 1.0
+
+    def expected_wait(self, priority: int = 1) -> float:
+        """Сколько секунд новый запрос прождет слота: очередь перед ним на среднюю задержку живых узлов."""
+        if self._slots.in_flight < self._slots.limit and self._slots.queued == 0:
+            return 0.0
+        return (self._slots.ahead(priority) + 1) / self._slots.limit * self.mean_latency()
+
+    def shed_wait(self, deadline: Optional[float] = None) -> float:
+        """Порог ожидания, после которого запрос не ставится в очередь.
+
+        Не больше LLM_QUEUE_TIMEOUT и остатка до deadline за вычетом ответа
+        узла: запрос, который не успеет получить слот и ответ, в очередь не встает.
+        """
+        latency = self.mean_latency()
+        limit = min(max(LLM_SHED_WAIT, LLM_SHED_FACTOR * latency), LLM_QUEUE_TIMEOUT)
+        if deadline is not None:
+            limit = min(limit, deadline - time.monotonic() - latency)
+        return limit
+
+    async def _acquire(self, priority: int, deadline: float):
+        self._slots.resize(self.capacity())
+        wait, limit = self.expected_wait(priority), self.shed_wait(deadline)
+        # Свободный слот берем всегда; в очередь - только если дождемся его раньше таймаута
+        if wait > 0 and wait >= limit:
+            # Ждать дольше, чем стоит ответ без LLM: не занимаем очередь и сразу отдаем деградированный ответ
+            self.shed += 1
+            LLM_SCHEDULED_TOTAL.inc(outcome="shed")
+            raise LLMBusy(f"Expected LLM wait {wait:.1f}s exceeds {limit:.1f}s")
+        await self._slots.acquire(priority, deadline - time.monotonic())
+
+    @property
+    def in_flight(self) -> int:
+        return self._slots.in_flight
+
+    @property
+    def queued(self) -> int:
+        return self._slots.queued
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._slots.stats(),
+            "coalesced": self._coalescer.merged,
+            "shed": self.shed,
+            "expected_wait": round(self.expected_wait(), 3),
+            "shed_wait": round(self.shed_wait(), 3),
+            "nodes": [node.stats() for node in self.nodes],
+        }
+
+    def is_warm(self) -> bool:
+        node = self.pick_node()
+        return node is None or node.is_warm(self.model)
+
+    async def warm(self, node: OllamaNode) -> bool:
         try:
-            return requests.get(f"{self.base_url}/api/tags", timeout=5).status_code == 200
-        except:
+            session = await self._get_session()
+            # Запрос без prompt только загружает модель в память. num_ctx тот же, что у тикетов:
+            # с другим Ollama перезагрузил бы модель на первом же тикете
+            async with session.post(
+                f"{node.base_url}/api/generate",
+                json={"model": self.model, "keep_alive": f"{OLLAMA_KEEP_ALIVE}s",
+                      "options": {"num_ctx": LLM_NUM_CTX}},
+                timeout=aiohttp.ClientTimeout(total=120)
+            ) as r:
+                if r.status == 200:
+                    node.last_used[self.model] = time.monotonic()
+                    return True
+        except Exception as e:
+            logger.warning(f"LLM warm-up failed on {node.base_url}: {e}")
+        return False
+
+    def warm_up(self) -> bool:
+        """Загружает модель на узле, который получит следующий запрос; не ждет загрузки."""
+        if self._warm_task is not None and not self._warm_task.done():
+            return False
+        node = self.pick_node()
+        if node is None or node.is_warm(self.model):
             return False
+        self._warm_task = asyncio.create_task(self.warm(node))
+        return True
+
+    def _build_payload(self, prompt: Dict[str, Any], model: str, stream: bool) -> Dict[str, Any]:
+        return {
+            "model": model,
+            "messages": prompt["messages"],
+            "stream": stream,
+            "keep_alive": f"{OLLAMA_KEEP_ALIVE}s",
+            "options": prompt["options"]
+        }
+
+    async def generate_response(self, user_message: str, context: Optional[Dict[str, Any]] = None,
+                                priority: int = 1, category: Optional[str] = None,
+                                usage: Optional[Dict[str, int]] = None) -> Optional[str]:
+        """Ответ LLM или None, если не ответил ни один узел; LLMBusy, если до Ollama дело не дошло.
 
-    def generate_response(self, user_message: str, context: Optional[Dict[str, Any]] = None) -> Optional[str]:
-        system_prompt = "Ты - AI-ассистент техподдержки Росатом. Отвечай четко. Если не уверен, предлагай обратиться к оператору."
-        if context:
-            system_prompt += f"\nКонтекст: {context}"
+        В usage (если передан) записываются токены вызова: prompt, completion
+        и estimated - оценка промпта до отправки. Присоединившийся к чужому
+        вызову запрос токенов не тратит, и usage у него остается пустым.
+        """
+        key = (normalize_text(user_message), category, json.dumps(context, ensure_ascii=False, sort_keys=True))
+        return await self._coalescer.run(key, lambda: self._generate(user_message, context, priority, category, usage))
+
+    async def _generate(self, user_message: str, context: Optional[Dict[str, Any]], priority: int,
+                        category: Optional[str], usage: Optional[Dict[str, int]]) -> Optional[str]:
+        prompt = build_prompt(user_message, context, category)
+        deadline = time.monotonic() + LLM_TOTAL_TIMEOUT
+        await self._acquire(priority, deadline)
         try:
-            r = requests.post(
-                f"{self.base_url}/api/chat",
-                json={
-                    "model": self.model,
-                    "messages": [{"role": "system", "content": system_prompt},
-                                 {"role": "user", "content": user_message}],
-                    "stream": False,
-                    "options": {"temperature": 0.3}
-                },
-                timeout=30
-            )
-            if r.status_code == 200:
-                return r.json()['message']['content']
-        except Exception as e:
-            logger.error(f"LLM error: {e}")
+            for node, model in self._attempts():
+                remaining = deadline - time.monotonic()
+                if remaining <= 1:
+                    logger.warning(f"LLM call deadline {LLM_TOTAL_TIMEOUT}s reached, giving up")
+                    break
+                content = await self._chat(node, model, prompt, category, usage, min(LLM_REQUEST_TIMEOUT, remaining))
+                if content:
+                    return content
+        finally:
+            self._slots.release()
         return None
 
+    async def _chat(self, node: OllamaNode, model: str, prompt: Dict[str, Any], category: Optional[str],
+                    usage: Optional[Dict[str, int]], timeout: float = LLM_REQUEST_TIMEOUT) -> Optional[str]:
+        node.outstanding += 1
+        started = time.monotonic()
+        content = None
+        try:
+            session = await self._get_session()
+            async with session.post(
+                f"{node.base_url}/api/chat",
+                json=self._build_payload(prompt, model, stream=False),
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as r:
+                if r.status == 200:
+                    data = await r.json()
+                    content = data['message']['content']
+                    tokens = record_llm_stats(data, category)
+                    if usage is not None:
+                        usage.update(tokens, estimated=prompt["estimated_tokens"])
+                else:
+                    logger.error(f"LLM error on {node.base_url} ({model}): HTTP {r.status}")
+        except Exception as e:
+            logger.error(f"LLM error on {node.base_url} ({model}): {e}")
+        finally:
+            node.outstanding -= 1
+        node.record(bool(content), time.monotonic() - started, model)
+        return content
+
+    async def stream_response(self, user_message: str, context: Optional[Dict[str, Any]] = None,
+                              priority: int = 1, category: Optional[str] = None,
+                              usage: Optional[Dict[str, int]] = None,
+                              status: Optional[Dict[str, bool]] = None) -> AsyncIterator[str]:
+        """Отдает фрагменты ответа по мере генерации (Ollama присылает NDJSON).
+
+        Пока не пришел первый фрагмент, ошибка узла ведет к повтору на другом;
+        оборванный после этого ответ не повторяется, генератор просто
+        завершается, и вызывающий код сам решает, чем заменить пустой или
+        оборванный ответ. В status["finished"] (если передан) - дошел ли ответ
+        до конца. Если слот не получен, бросается LLMBusy до первого
+        фрагмента. usage - как в generate_response.
+        """
+        prompt = build_prompt(user_message, context, category)
+        deadline = time.monotonic() + LLM_TOTAL_TIMEOUT
+        await self._acquire(priority, deadline)
+        try:
+            for node, model in self._attempts():
+                if deadline - time.monotonic() <= 1:
+                    logger.warning(f"LLM stream deadline {LLM_TOTAL_TIMEOUT}s reached, giving up")
+                    break
+                node.outstanding += 1
+                started = time.monotonic()
+                received = finished = False
+                try:
+                    session = await self._get_session()
+                    async with session.post(
+                        f"{node.base_url}/api/chat",
+                        json=self._build_payload(prompt, model, stream=True),
+                        # Общий лимит не ставим: длинный ответ приходит частями, ограничиваем паузу между ними
+                        timeout=aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=LLM_REQUEST_TIMEOUT)
+                    ) as r:
+                        if r.status != 200:
+                            logger.error(f"LLM stream error on {node.base_url} ({model}): HTTP {r.status}")
+                        else:
+                            async for line in r.content:
+                                if not line.strip():
+                                    continue
+                                chunk = json.loads(line)
+                                token = chunk.get("message", {}).get("content", "")
+                                if token:
+                                    received = True
+                                    yield token
+                                if chunk.get("done"):
+                                    finished = True
+                                    if status is not None:
+                                        status["finished"] = True
+                                    tokens = record_llm_stats(chunk, category)
+                                    if usage is not None:
+                                        usage.update(tokens, estimated=prompt["estimated_tokens"])
+                                    break
+                except Exception as e:
+                    logger.error(f"LLM stream error on {node.base_url} ({model}): {e}")
+                finally:
+                    node.outstanding -= 1
+                node.record(received and finished, time.monotonic() - started, model)
+                if received:
+                    return
+        finally:
+            self._slots.release()
+
+# --- Мониторинг LLM ---
+class OllamaMonitor:
+    """Кэширует состояние узла Ollama, чтобы тикеты и /health не ходили в сеть.
+
+    Фоновая задача раз в OLLAMA_HEALTH_INTERVAL секунд опрашивает /api/tags узла.
+    После OLLAMA_FAILURE_THRESHOLD ошибок подряд цепь размыкается (state="down"),
+    и интервал опроса растет экспоненциально до OLLAMA_HEALTH_MAX_INTERVAL.
+    Ошибки и успехи реальных вызовов LLM тоже учитываются.
+    """
+
+    UP = "up"
+    DEGRADED = "degraded"
+    DOWN = "down"
+    UNKNOWN = "unknown"
+
+    def __init__(self, client: "OllamaNode"):
+        self.client = client
+        self.interval = OLLAMA_HEALTH_INTERVAL
+        self.max_interval = OLLAMA_HEALTH_MAX_INTERVAL
+        self.degraded_latency = OLLAMA_DEGRADED_LATENCY
+        self.failure_threshold = OLLAMA_FAILURE_THRESHOLD
+        self.state = self.UNKNOWN
+        self.last_latency: Optional[float] = None
+        self.last_check: Optional[str] = None
+        self.consecutive_failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def is_available(self) -> bool:
+        return self.state in (self.UP, self.DEGRADED)
+
+    @property
+    def circuit_open(self) -> bool:
+        return self.consecutive_failures >= self.failure_threshold
+
+    def record_success(self, latency: Optional[float] = None):
+        # latency передается только для пробы /api/tags: время генерации ответа с ней несравнимо
+        self.consecutive_failures = 0
+        if latency is not None:
+            self.last_latency = latency
+        slow = self.last_latency is not None and self.last_latency > self.degraded_latency
+        self.state = self.DEGRADED if slow else self.UP
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        # Единичная ошибка у работающей Ollama - деградация; если она еще ни разу не ответила - down
+        if self.circuit_open or self.state in (self.UNKNOWN, self.DOWN):
+            self.state = self.DOWN
+        else:
+            self.state = self.DEGRADED
+
+    def next_delay(self) -> float:
+        if not self.circuit_open:
+            return self.interval
+        backoff = 2 ** (self.consecutive_failures - self.failure_threshold + 1)
+        return min(self.interval * backoff, self.max_interval)
+
+    async def check(self):
+        started = time.monotonic()
+        available = await self.client.is_available()
+        self.last_check = datetime.now().isoformat()
+        if available:
+            self.record_success(time.monotonic() - started)
+        else:
+            self.record_failure()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Ollama monitor error: {e}")
+            await asyncio.sleep(self.next_delay())
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "last_latency": self.last_latency,
+            "last_check": self.last_check,
+            "consecutive_failures": self.consecutive_failures,
+            "circuit_open": self.circuit_open,
+        }
+
+
+class PoolMonitor:
+    """Сводное состояние узлов LLMClient: LLM доступна, пока доступен хоть один узел.
+
+    Каждый узел проверяет свой OllamaMonitor; исходы реальных вызовов
+    учитывает сам LLMClient.
+    """
+
+    UP = OllamaMonitor.UP
+    DEGRADED = OllamaMonitor.DEGRADED
+    DOWN = OllamaMonitor.DOWN
+    UNKNOWN = OllamaMonitor.UNKNOWN
+
+    def __init__(self, client: LLMClient):
+        self.client = client
+
+    @property
+    def monitors(self) -> List[OllamaMonitor]:
+        return [node.monitor for node in self.client.nodes]
+
+    def is_available(self) -> bool:
+        return any(monitor.is_available() for monitor in self.monitors)
+
+    @property
+    def state(self) -> str:
+        states = {monitor.state for monitor in self.monitors}
+        if states == {self.UP}:
+            return self.UP
+        if self.is_available():
+            return self.DEGRADED
+        return self.UNKNOWN if states == {self.UNKNOWN} else self.DOWN
+
+    def start(self):
+        for monitor in self.monitors:
+            monitor.start()
+
+    async def stop(self):
+        for monitor in self.monitors:
+            await monitor.stop()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "nodes": {node.base_url: node.monitor.snapshot() for node in self.client.nodes},
+        }
+
 # --- Ответы ---
 class ResponseGenerator:
     FALLBACK = "Понял ваш запрос. Уточните детали проблемы."
     ERROR = "Не удалось обработать запрос. Обратитесь к оператору."
+    BUSY = "Сейчас обращений больше обычного, и AI-ассистент не успевает ответить. Ваш запрос передан оператору."
 
     @staticmethod
     def llm_fallback(message: str) -> str:
         return f"Запрос: '{message}' получен. В настоящее время AI сервис недоступен. Обратитесь к оператору."
 
 # --- Инициализация ---
-classifier = SimpleClassifier()
-knowledge_base = SimpleKnowledgeBase()
+# Автомат базы знаний знает и ключевые слова классификатора: сообщение сканируется один раз
+knowledge_base = SimpleKnowledgeBase(extra_vocabulary=SimpleClassifier.vocabulary())
+classifier = SimpleClassifier(knowledge_base.matcher)
+retriever = EmbeddingRetriever()
 llm_client = LLMClient()
+llm_monitor = PoolMonitor(llm_client)
+response_cache = ResponseCache(
+    max_size=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    similarity=RESPONSE_CACHE_SIMILARITY
+)
 response_gen = ResponseGenerator()
-tickets_history: List[Dict[str, Any]] = []
+ticket_store = TicketStore()
+sessions = SessionStore()
+admission = AdmissionController()
+
+async def sync_retriever(index: KnowledgeIndex):
+    if warmup.components["rag"].state == Component.PENDING:
+        # lazy: модель еще не грузилась, индекс построится при первом поиске по актуальным статьям
+        return
+    try:
+        await asyncio.to_thread(retriever.sync, index.articles)
+    except Exception as e:
+        # Нет sentence-transformers или модели - работаем только по триггерам
+        logger.warning(f"Embedding retrieval disabled: {e}")
+
+async def load_classifier() -> bool:
+    # Импорт sklearn и чтение модели - в потоке, чтобы не останавливать обработку тикетов
+    return await asyncio.to_thread(get_ticket_model) is not None
+
+async def load_retriever() -> bool:
+    await asyncio.to_thread(retriever.sync, knowledge_base.index.articles)
+    return True
+
+async def warm_llm() -> bool:
+    # Каждый узел пула поднимает модель заранее, чтобы первый тикет не ждал ее загрузки
+    return any(await asyncio.gather(*[llm_client.warm(node) for node in llm_client.nodes]))
+
+# Тяжелые компоненты грузятся по STARTUP_MODE; до их готовности тикеты обслуживаются с деградацией
+warmup = Warmup()
+warmup.add("classifier", load_classifier)
+warmup.add("rag", load_retriever, enabled=RAG_ENABLED)
+warmup.add("llm", warm_llm, required=False)
+
+@app.on_event("startup")
+async def startup():
+    await llm_client.start()
+    llm_monitor.start()
+    knowledge_base.start()
+    ticket_store.start()
+    metrics_registry.start()
+    if RAG_ENABLED:
+        knowledge_base.listeners.append(sync_retriever)
+    await warmup.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await warmup.stop()
+    await llm_monitor.stop()
+    await knowledge_base.stop()
+    await ticket_store.stop()
+    await metrics_registry.stop()
+    await llm_client.close()
 
 # --- Эндпоинты ---
-@app.post("/tickets/", response_model=TicketResponse)
-async def create_ticket(ticket: TicketRequest):
-    ticket_id = f"TKT-{uuid.uuid4().hex[:8].upper()}"
-    classification = classifier.classify(ticket.message)
-    kb_result = knowledge_base.search(ticket.message, classification["category"])
+def new_ticket_id() -> str:
+    # 96 бит: при 8 hex-символах совпадение ticket_id вероятно уже к ~80 тыс. тикетов
+    return f"TKT-{uuid.uuid4().hex[:24].upper()}"
 
-    response_text = ""
-    solution_steps: List[str] = []
-    source = "knowledge_base"
-    confidence = classification["confidence"]
+def is_confident_kb_hit(kb_result: Optional[Dict[str, Any]]) -> bool:
+    return bool(kb_result) and kb_result.get("confidence", 0) > 0.7
 
-    if kb_result and kb_result.get("confidence", 0) > 0.7:
-        response_text = kb_result["answer"]
-        solution_steps = kb_result.get("steps", [])
-        confidence = kb_result["confidence"]
-    else:
-        if llm_client.is_available():
-            context = {"similar_solution": kb_result.get("answer")} if kb_result else {}
-            llm_response = llm_client.generate_response(ticket.message, context)
-            if llm_response:
-                response_text = llm_response
-                source = "llm"
-                confidence = 0.6
-            else:
-                response_text = response_gen.llm_fallback(ticket.message)
-                source = "error"
-                confidence = 0.1
-        else:
-            response_text = kb_result["answer"] if kb_result else response_gen.FALLBACK
-            source = "knowledge_base"
+def is_trusted(classification: Dict[str, Any]) -> bool:
+    return classification["confidence"] >= CLASSIFIER_KB_CONFIDENCE
 
-    needs_human = confidence < 0.3 or len(ticket.message.strip()) < 3 or classification["category"] == "other"
+async def lookup_knowledge_batch(messages: List[str], classifications: List[Dict[str, Any]],
+                                 matches: List[set]) -> List[Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]]:
+    """Статьи базы знаний по триггерам, а для промахов - по эмбеддингам одним батчем."""
+    with stage("kb_search"):
+        # Поиск по пакету в тысячи тикетов - заметное время CPU, в цикле событий он задержал бы остальные запросы
+        kb_results = await asyncio.to_thread(
+            lambda: [knowledge_base.search(m, c["category"], mt, is_trusted(c))
+                     for m, c, mt in zip(messages, classifications, matches)])
+    passages: List[List[Dict[str, Any]]] = [[] for _ in messages]
+    misses = [i for i, kb_result in enumerate(kb_results) if not is_confident_kb_hit(kb_result)]
+    if misses and not retriever.ready:
+        warmup.ensure("rag")
+    if misses and retriever.ready:
+        with stage("rag"):
+            found = await asyncio.to_thread(retriever.search_batch, [messages[i] for i in misses], RAG_TOP_K)
+        for i, hits in zip(misses, found):
+            passages[i] = hits
+            if hits and hits[0]["score"] >= RAG_DIRECT_SCORE:
+                kb_results[i] = hits[0]["article"]
+    return list(zip(kb_results, passages))
 
-    response = TicketResponse(
+def build_context(kb_result: Optional[Dict[str, Any]], passages: List[Dict[str, Any]],
+                  session: Optional[Session] = None) -> Dict[str, Any]:
+    context: Dict[str, Any] = {}
+    if session is not None:
+        # Уточнение: статьи берем из начала диалога, а не ищем заново
+        kb_result = kb_result or session.kb_result
+        passages = passages or session.passages
+        context["history"] = session.summary
+    if kb_result:
+        context["similar_solution"] = kb_result.get("answer")
+    relevant = [p["text"] for p in passages if p["score"] >= RAG_CONTEXT_SCORE]
+    if relevant:
+        context["passages"] = relevant
+    return context
+
+def needs_operator(message: str, category: str, confidence: float) -> bool:
+    return confidence < 0.3 or len(message.strip()) < 3 or category == "other"
+
+def finalize_ticket(ticket: TicketRequest, ticket_id: str, classification: Dict[str, Any],
+                    response_text: str, source: str, confidence: float,
+                    solution_steps: List[str], tokens: Optional[Dict[str, int]] = None) -> TicketResponse:
+    needs_human = record_ticket(ticket, ticket_id, classification, response_text, source, confidence, tokens)
+    return TicketResponse(
         ticket_id=ticket_id,
         response=response_text,
         category=classification["category"],
         confidence=confidence,
         source=source,
         needs_human=needs_human,
-        solution_steps=solution_steps
+        solution_steps=solution_steps,
+        tokens=tokens or None
     )
 
-    tickets_history.append({
+def record_ticket(ticket: TicketRequest, ticket_id: str, classification: Dict[str, Any], response_text: str,
+                  source: str, confidence: float, tokens: Optional[Dict[str, int]] = None) -> bool:
+    """Сохраняет тикет, пишет метрики и лог; возвращает needs_human."""
+    needs_human = needs_operator(ticket.message, classification["category"], confidence)
+    ticket_store.add({
         "ticket_id": ticket_id,
         "user_id": ticket.user_id,
         "message": ticket.message,
@@ -295,25 +942,560 @@ async def create_ticket(ticket: TicketRequest):
         "category": classification["category"],
         "source": source,
         "confidence": confidence,
+        "needs_human": needs_human,
         "timestamp": datetime.now().isoformat()
     })
 
-    logger.info(f"Processed ticket {ticket_id}, source: {source}, category: {classification['category']}")
-    return response
+    TICKETS_TOTAL.inc(category=classification["category"], source=source, needs_human=str(needs_human).lower())
+    summary = f"Processed ticket {ticket_id}, source: {source}, category: {classification['category']}"
+    if tokens:
+        summary += f", tokens: {tokens.get('prompt', 0)}+{tokens.get('completion', 0)} (estimated prompt {tokens.get('estimated', 0)})"
+    trace = current_trace.get()
+    if trace is None:
+        logger.info(summary)
+        return needs_human
+
+    TICKET_SECONDS.observe(trace.elapsed, source=source)
+    logger.info(f"{summary}, trace: {trace.trace_id}")
+    if trace.sampled:
+        logger.info(f"Trace {trace.trace_id} {ticket_id}: total={trace.elapsed * 1000:.2f}ms {trace.server_timing()}")
+    return needs_human
+
+def payload_response(request: Request, payload: ArticlePayload, ticket: TicketRequest, ticket_id: str,
+                     classification: Dict[str, Any], confidence: float) -> Response:
+    """Ответ статьей из готового тела: без TicketResponse и повторной сериализации текста статьи.
+
+    Если клиент принимает gzip, тело отдается уже сжатым (nginx его не пересжимает).
+    """
+    needs_human = record_ticket(ticket, ticket_id, classification, payload.article["answer"], "knowledge_base",
+                                confidence)
+    fields = (ticket_id, classification["category"], confidence, needs_human)
+    headers = {"Vary": "Accept-Encoding"}
+    body = payload.render_gzip(*fields) if accepts_gzip(request.headers.get("accept-encoding", "")) else None
+    if body is not None:
+        headers["Content-Encoding"] = "gzip"
+    else:
+        body = payload.render(*fields)
+    return Response(body, media_type="application/json", headers=headers)
+
+def knowledge_answer(kb_result: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "response_text": kb_result["answer"],
+        "source": "knowledge_base",
+        "confidence": kb_result["confidence"],
+        "solution_steps": kb_result.get("steps", []),
+    }
+
+def llm_priority(message: str, classification: Dict[str, Any]) -> int:
+    """Приоритет в очереди LLM: приветствия и короткие тикеты (0) раньше обычных (1)."""
+    if classification["category"] == "greeting" or len(message.strip()) <= LLM_SHORT_MESSAGE:
+        return 0
+    return 1
+
+def knowledge_fallback(kb_result: Optional[Dict[str, Any]]) -> str:
+    return kb_result["answer"] if kb_result else response_gen.FALLBACK
+
+def degraded_answer(kb_result: Optional[Dict[str, Any]], classification: Dict[str, Any]) -> Tuple[str, float]:
+    """Ответ без LLM при перегрузке: неуверенная статья базы знаний или шаблон.
+
+    У шаблона низкая уверенность, чтобы тикет ушел оператору (needs_human).
+    """
+    if kb_result:
+        return kb_result["answer"], classification["confidence"]
+    return response_gen.BUSY, 0.2
+
+async def resolve_answer(message: str, classification: Dict[str, Any], kb_result: Optional[Dict[str, Any]],
+                         passages: List[Dict[str, Any]], priority: Optional[int] = None,
+                         session: Optional[Session] = None) -> Dict[str, Any]:
+    """Ответ на тикет: статья базы знаний, кэш, LLM или заглушка.
+
+    session - диалог, который продолжает тикет: его сводка и статьи идут в контекст LLM.
+    """
+    if is_confident_kb_hit(kb_result):
+        return knowledge_answer(kb_result)
+
+    solution_steps: List[str] = []
+    tokens: Dict[str, int] = {}
+    confidence = classification["confidence"]
+    context = build_context(kb_result, passages, session)
+    with stage("cache"):
+        cached = response_cache.get(message, context)
+    with stage("llm_check"):
+        llm_available = cached is None and llm_monitor.is_available()
+    if cached is not None:
+        response_text = cached
+        source = "cache"
+        confidence = 0.6
+    elif llm_available:
+        llm_busy = False
+        try:
+            with stage("llm"):
+                llm_response = await llm_client.generate_response(
+                    message, context, llm_priority(message, classification) if priority is None else priority,
+                    classification["category"], tokens)
+        except LLMBusy as e:
+            # Ollama жива, просто занята: это не сбой для монитора
+            logger.warning(f"Answering without LLM: {e}")
+            llm_response = None
+            llm_busy = True
+        if llm_response:
+            response_cache.put(message, context, llm_response)
+            response_text = llm_response
+            source = "llm"
+            confidence = 0.6
+        elif llm_busy and LLM_BUSY_KB_FALLBACK:
+            response_text, confidence = degraded_answer(kb_result, classification)
+            source = "degraded"
+        else:
+            response_text = response_gen.llm_fallback(message)
+            source = "error"
+            confidence = 0.1
+    else:
+        response_text = knowledge_fallback(kb_result)
+        source = "knowledge_base"
+
+    return {
+        "response_text": response_text,
+        "source": source,
+        "confidence": confidence,
+        "solution_steps": solution_steps,
+        "tokens": tokens,
+    }
+
+def admit_ticket(ticket: TicketRequest) -> Callable[[], None]:
+    """Пропуск тикета контролем нагрузки; отказ - 429/503 с Retry-After вместо ожидания в очередях."""
+    try:
+        return admission.admit(ticket.user_id)
+    except Rejected as e:
+        logger.warning(f"Ticket from {ticket.user_id} rejected: {e.reason}")
+        raise HTTPException(status_code=e.status, detail=f"Ticket rejected: {e.reason}",
+                            headers={"Retry-After": e.retry_after_header})
+
+def begin_trace(request: Request, response: Response):
+    """Трасса запроса; X-Trace: 1 включает разбивку по этапам вне выборки."""
+    trace = start_trace(force_sample=request.headers.get("X-Trace") == "1",
+                        trace_id=request.headers.get("X-Trace-Id"))
+    response.headers["X-Trace-Id"] = trace.trace_id
+    return trace
+
+def classify_message(message: str) -> Tuple[set, Dict[str, Any]]:
+    with stage("classify"):
+        matches = knowledge_base.matcher.find(message)
+        return matches, classifier.classify(message, matches)
+
+# --- Конвейер тикета ---
+# classify -> session -> kb_search -> (rag || llm_warmup) -> answer. Уверенное попадание
+# в базу знаний завершает конвейер сразу: RAG и LLM для такого тикета не нужны.
+# Уточнение к открытому диалогу не ищется заново: тема и статьи берутся из диалога.
+def classify_stage(ctx: TicketContext) -> Tuple[set, Dict[str, Any]]:
+    return classify_message(ctx.message)
+
+def session_stage(ctx: TicketContext) -> Optional[Session]:
+    _, classification = ctx.results["classify"]
+    return sessions.follow_up(ctx.user_id, ctx.message, classification)
+
+def ticket_classification(ctx: TicketContext) -> Dict[str, Any]:
+    """Классификация тикета; у уточнения - категория диалога, а не самого сообщения."""
+    session = ctx.results.get("session")
+    return session.classification if session is not None else ctx.results["classify"][1]
+
+def kb_search_stage(ctx: TicketContext) -> Optional[Dict[str, Any]]:
+    if ctx.results.get("session") is not None:
+        # Статья диалога уже выдана и, раз пользователь пишет снова, не помогла - ответит LLM
+        return None
+    matches, classification = ctx.results["classify"]
+    with stage("kb_search"):
+        kb_result = knowledge_base.search(ctx.message, classification["category"], matches, is_trusted(classification))
+    if is_confident_kb_hit(kb_result):
+        ctx.finish(knowledge_answer(kb_result))
+    return kb_result
+
+async def rag_stage(ctx: TicketContext) -> List[Dict[str, Any]]:
+    if ctx.results.get("session") is not None:
+        return []
+    if not retriever.ready:
+        warmup.ensure("rag")
+        return []
+    with stage("rag"):
+        passages = await asyncio.to_thread(retriever.search, ctx.message, RAG_TOP_K)
+    if passages and passages[0]["score"] >= RAG_DIRECT_SCORE and is_confident_kb_hit(passages[0]["article"]):
+        ctx.finish(knowledge_answer(passages[0]["article"]))
+    return passages
+
+def llm_warmup_stage(ctx: TicketContext) -> bool:
+    # Пока идет поиск по эмбеддингам, Ollama успевает поднять выгруженную модель
+    return llm_monitor.is_available() and llm_client.warm_up()
+
+def knowledge_result(ctx: TicketContext) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Статья и абзацы, найденные конвейером (RAG мог не успеть - тогда без абзацев)."""
+    kb_result = ctx.results.get("kb_search")
+    passages = ctx.results.get("rag") or []
+    if passages and passages[0]["score"] >= RAG_DIRECT_SCORE:
+        kb_result = passages[0]["article"]
+    return kb_result, passages
+
+async def answer_stage(ctx: TicketContext) -> Dict[str, Any]:
+    kb_result, passages = knowledge_result(ctx)
+    return await resolve_answer(ctx.message, ticket_classification(ctx), kb_result, passages,
+                                session=ctx.results.get("session"))
+
+def remember_turn(ctx: TicketContext, classification: Dict[str, Any], response_text: str, source: str):
+    """Добавляет реплику в диалог пользователя; новое обращение открывает новый диалог."""
+    session = ctx.results.get("session")
+    if session is None:
+        if classification["category"] == "greeting":
+            return
+        kb_result, passages = knowledge_result(ctx)
+        session = sessions.start(ctx.user_id, ctx.message, classification, kb_result, passages)
+    session.add_turn(ctx.message, response_text, source)
+
+lookup_stages = [
+    FunctionStage("classify", classify_stage),
+    FunctionStage("session", session_stage, requires=("classify",)),
+    FunctionStage("kb_search", kb_search_stage, requires=("session",)),
+    FunctionStage("rag", rag_stage, requires=("kb_search",), timeout=RAG_TIMEOUT),
+    FunctionStage("llm_warmup", llm_warmup_stage, requires=("kb_search",)),
+]
+# Для стриминга ответ генерируется в самом эндпоинте
+lookup_pipeline = Orchestrator(lookup_stages)
+ticket_pipeline = Orchestrator(lookup_stages + [
+    FunctionStage("answer", answer_stage, requires=("kb_search", "rag")),
+])
+
+async def run_pipeline(pipeline: Orchestrator, ticket: TicketRequest) -> TicketContext:
+    ctx = await pipeline.run(TicketContext(ticket.message, ticket.user_id))
+    if "classify" not in ctx.results:
+        raise HTTPException(status_code=500, detail="Ticket classification failed")
+    return ctx
+
+@app.post("/tickets/", response_model=TicketResponse)
+async def create_ticket(ticket: TicketRequest, request: Request, response: Response):
+    trace = begin_trace(request, response)
+    release = admit_ticket(ticket)
+    try:
+        ticket_id = new_ticket_id()
+        ctx = await run_pipeline(ticket_pipeline, ticket)
+        classification = ticket_classification(ctx)
+
+        answer = ctx.answer if ctx.finished else ctx.results.get("answer")
+        if answer is None:
+            answer = {"response_text": response_gen.llm_fallback(ticket.message), "source": "error",
+                      "confidence": 0.1, "solution_steps": []}
+        # Ответ статьей - самый частый: его тело собрано заранее при загрузке базы знаний
+        kb_result, _ = knowledge_result(ctx)
+        payload = None
+        if answer["source"] == "knowledge_base" and is_confident_kb_hit(kb_result):
+            payload = knowledge_base.payload(kb_result)
+        if payload is not None:
+            result = payload_response(request, payload, ticket, ticket_id, classification, answer["confidence"])
+        else:
+            result = finalize_ticket(ticket, ticket_id, classification, **answer)
+        remember_turn(ctx, classification, answer["response_text"], answer["source"])
+    finally:
+        release()
+    if trace.sampled:
+        response.headers["Server-Timing"] = trace.server_timing()
+    if isinstance(result, Response):
+        # Заголовки трассы выставлены на response, а он не используется, если эндпоинт сам вернул Response
+        result.headers.update(response.headers)
+    return result
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/tickets/stream")
+async def create_ticket_stream(ticket: TicketRequest, request: Request):
+    """Тот же тикет, что и /tickets/, но ответом в виде Server-Sent Events.
+
+    События: meta (классификация и результат поиска по базе знаний, сразу),
+    token (фрагменты ответа LLM по мере генерации), done (поля TicketResponse).
+    """
+    trace = start_trace(force_sample=request.headers.get("X-Trace") == "1",
+                        trace_id=request.headers.get("X-Trace-Id"))
+    release = admit_ticket(ticket)
+    ticket_id = new_ticket_id()
+    try:
+        ctx = await run_pipeline(lookup_pipeline, ticket)
+    except BaseException:
+        release()
+        raise
+    classification = ticket_classification(ctx)
+    kb_result, passages = knowledge_result(ctx)
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            async for event in ticket_events():
+                yield event
+        finally:
+            release()
+
+    async def ticket_events() -> AsyncIterator[str]:
+        kb_hit = is_confident_kb_hit(kb_result)
+        context = build_context(kb_result, passages, ctx.results.get("session"))
+        cached = None if kb_hit else response_cache.get(ticket.message, context)
+        llm_bound = not kb_hit and cached is None and llm_monitor.is_available()
+        if kb_hit:
+            planned_source = "knowledge_base"
+        elif cached is not None:
+            planned_source = "cache"
+        else:
+            planned_source = "llm" if llm_bound else "knowledge_base"
+        yield sse_event("meta", {
+            "ticket_id": ticket_id,
+            "category": classification["category"],
+            "confidence": classification["confidence"],
+            "kb_match": kb_result is not None,
+            "source": planned_source,
+        })
+
+        solution_steps: List[str] = []
+        tokens: Dict[str, int] = {}
+        if kb_hit:
+            response_text = kb_result["answer"]
+            solution_steps = kb_result.get("steps", [])
+            source = "knowledge_base"
+            confidence = kb_result["confidence"]
+        elif cached is not None:
+            yield sse_event("token", {"text": cached})
+            response_text = cached
+            source = "cache"
+            confidence = 0.6
+        elif llm_bound:
+            parts: List[str] = []
+            status: Dict[str, bool] = {}
+            llm_busy = False
+            try:
+                with stage("llm"):
+                    async for token in llm_client.stream_response(
+                            ticket.message, context, llm_priority(ticket.message, classification),
+                            classification["category"], tokens, status):
+                        parts.append(token)
+                        yield sse_event("token", {"text": token})
+            except LLMBusy as e:
+                logger.warning(f"Answering without LLM: {e}")
+                llm_busy = True
+            if parts and status.get("finished"):
+                response_text = "".join(parts)
+                response_cache.put(ticket.message, context, response_text)
+                source = "llm"
+                confidence = 0.6
+            elif parts:
+                # Ответ оборвался: клиент его уже видел, но в кэш он не идет, а тикет уходит оператору
+                logger.warning(f"LLM stream for {ticket_id} broke off after {len(parts)} chunks")
+                response_text = "".join(parts)
+                source = "degraded"
+                confidence = 0.2
+            elif llm_busy and LLM_BUSY_KB_FALLBACK:
+                response_text, confidence = degraded_answer(kb_result, classification)
+                yield sse_event("token", {"text": response_text})
+                source = "degraded"
+            else:
+                response_text = response_gen.llm_fallback(ticket.message)
+                source = "error"
+                confidence = 0.1
+        else:
+            response_text = knowledge_fallback(kb_result)
+            source = "knowledge_base"
+            confidence = classification["confidence"]
+
+        response = finalize_ticket(ticket, ticket_id, classification, response_text, source, confidence,
+                                   solution_steps, tokens)
+        remember_turn(ctx, classification, response_text, source)
+        yield sse_event("done", response.model_dump())
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # X-Accel-Buffering отключает буферизацию в nginx, иначе токены придут одним куском
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Trace-Id": trace.trace_id},
+        # Если клиент ушел до начала стрима, генератор не запускался и тикет освобождается здесь
+        background=BackgroundTask(release)
+    )
+
+@app.post("/tickets/batch")
+async def create_tickets_batch(batch: TicketBatchRequest, request: Request):
+    """Пакетная обработка тикетов; результаты отдаются NDJSON по мере готовности.
+
+    Одинаковые (после нормализации) сообщения решаются один раз, классификация
+    и поиск по базе знаний идут одним проходом по пакету, а в LLM одновременно
+    уходит не больше BATCH_LLM_CONCURRENCY сообщений, чтобы не переполнить
+    общую очередь LLMClient. Каждая строка ответа - поля TicketResponse и
+    index - позиция тикета во входном списке. Диалоги пользователей
+    (SessionStore) пакет не читает и не пополняет: тикеты в нем независимы.
+    В общем лимите воркера (AdmissionController) пакет занимает столько мест,
+    сколько его тикетов одновременно идет в LLM (BATCH_LLM_CONCURRENCY);
+    при перегрузке он, как и одиночные тикеты, получает 503 с Retry-After.
+    Лимиты пользователей к пакету не применяются, а при перегрузке LLM его
+    тикеты, как и остальные, получают ответы source=degraded.
+    """
+    tickets = batch.tickets
+    if len(tickets) > TICKETS_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {TICKETS_BATCH_MAX} tickets")
+    try:
+        release = admission.admit_batch(min(len(tickets), BATCH_LLM_CONCURRENCY))
+    except Rejected as e:
+        logger.warning(f"Batch of {len(tickets)} tickets rejected: {e.reason}")
+        raise HTTPException(status_code=e.status, detail=f"Batch rejected: {e.reason}",
+                            headers={"Retry-After": e.retry_after_header})
+
+    groups: Dict[str, List[int]] = {}
+    for i, ticket in enumerate(tickets):
+        groups.setdefault(normalize_text(ticket.message) or ticket.message, []).append(i)
+    members = list(groups.values())
+    messages = [tickets[group[0]].message for group in members]
+
+    # Одна трасса на пакет: время тикета считается от начала пакета
+    trace = start_trace(force_sample=request.headers.get("X-Trace") == "1",
+                        trace_id=request.headers.get("X-Trace-Id"))
+
+    def classify_all() -> Tuple[List[set], List[Dict[str, Any]]]:
+        matches = [knowledge_base.matcher.find(m) for m in messages]
+        return matches, classifier.classify_batch(messages, matches)
+
+    # Классификация пакета в 5000 тикетов занимает больше секунды: считаем ее в потоке, чтобы
+    # не останавливать цикл событий для остальных тикетов и /health. Загрузку модели
+    # запускаем отсюда: из потока warmup ее не начнет
+    warmup.ensure("classifier")
+    try:
+        with stage("classify"):
+            matches, classifications = await asyncio.to_thread(classify_all)
+        lookups = await lookup_knowledge_batch(messages, classifications, matches)
+    except BaseException:
+        # Ответа не будет (ошибка или клиент ушел) - места в лимите освобождаем сразу
+        release()
+        raise
+    llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+    async def solve(j: int) -> Tuple[int, Dict[str, Any]]:
+        kb_result, passages = lookups[j]
+        async with llm_slots:
+            # Пакетные тикеты пропускают интерактивные вперед в очереди LLM
+            return j, await resolve_answer(messages[j], classifications[j], kb_result, passages, priority=2)
+
+    def lines(j: int, answer: Dict[str, Any]) -> Iterator[bytes]:
+        for n, i in enumerate(members[j]):
+            # Токены потрачены один раз - на первом тикете группы
+            response = finalize_ticket(tickets[i], new_ticket_id(), classifications[j],
+                                       **dict(answer, tokens=answer.get("tokens") if n == 0 else None))
+            yield json_dumps({"index": i, **response.model_dump()}) + b"\n"
+
+    async def results() -> AsyncIterator[str]:
+        # Задачи нужны только тикетам, которые идут в LLM; ответы статьями готовы сразу
+        kb_groups, llm_groups = [], []
+        for j, (kb_result, _) in enumerate(lookups):
+            (kb_groups if is_confident_kb_hit(kb_result) else llm_groups).append(j)
+        tasks = [asyncio.create_task(solve(j)) for j in llm_groups]
+        try:
+            for n, j in enumerate(kb_groups, 1):
+                for line in lines(j, knowledge_answer(lookups[j][0])):
+                    yield line
+                if n % BATCH_YIELD_EVERY == 0:
+                    # Отправка строки не всегда уступает цикл событий: без этого тысячи ответов ушли бы одним куском
+                    await asyncio.sleep(0)
+            for n, finished in enumerate(asyncio.as_completed(tasks), 1):
+                j, answer = await finished
+                for line in lines(j, answer):
+                    yield line
+                if n % BATCH_YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+        finally:
+            # Клиент ушел (или ошибка): нерешенные тикеты не должны дальше занимать слоты LLM
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Batch stream closed early, cancelled {len(pending)} of {len(tasks)} tickets")
+                await asyncio.gather(*pending, return_exceptions=True)
+            release()
+
+    # Если клиент ушел до начала стрима, генератор не запускался и пакет освобождается здесь
+    return StreamingResponse(results(), media_type="application/x-ndjson", headers={"X-Trace-Id": trace.trace_id},
+                             background=BackgroundTask(release))
+
+def history_filters(user_id: Optional[str] = None, category: Optional[str] = None,
+                    source: Optional[str] = None, needs_human: Optional[bool] = None,
+                    since: Optional[datetime] = None, until: Optional[datetime] = None) -> Dict[str, Any]:
+    return {"user_id": user_id, "category": category, "source": source,
+            "needs_human": needs_human, "since": since, "until": until}
+
+def history_fields(fields: Optional[str] = None) -> Optional[List[str]]:
+    if not fields:
+        return None
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in HISTORY_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return selected
 
 @app.get("/tickets/history")
-async def get_history():
-    return tickets_history
+async def get_history(
+    filters: Dict[str, Any] = Depends(history_filters),
+    fields: Optional[List[str]] = Depends(history_fields),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=TICKETS_PAGE_MAX),
+):
+    try:
+        return await ticket_store.page(filters, fields, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/tickets/history/export")
+async def export_history(
+    filters: Dict[str, Any] = Depends(history_filters),
+    fields: Optional[List[str]] = Depends(history_fields),
+):
+    """Выгрузка истории в NDJSON: одна строка - один тикет, отдается потоком."""
+    async def lines() -> AsyncIterator[str]:
+        async for record in ticket_store.export(filters, fields):
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/tickets/{ticket_id}")
+async def get_ticket(ticket_id: str):
+    record = await ticket_store.get(ticket_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    return record
+
+@app.get("/health/live")
+async def health_live():
+    """Liveness: воркер отвечает; модели при этом могут еще загружаться."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: 200, когда загружены обязательные компоненты, иначе 503."""
+    return JSONResponse(warmup.snapshot(), status_code=200 if warmup.ready else 503)
 
 @app.get("/health")
 async def health():
     return {
         "status": "healthy",
-        "ollama": "available" if llm_client.is_available() else "unavailable",
-        "tickets_processed": len(tickets_history),
+        "ready": warmup.ready,
+        "startup": warmup.snapshot(),
+        "ollama": "available" if llm_monitor.is_available() else "unavailable",
+        "ollama_monitor": llm_monitor.snapshot(),
+        "response_cache": response_cache.stats(),
+        "sessions": sessions.stats(),
+        "admission": admission.stats(),
+        "knowledge_base": knowledge_base.index.stats(),
+        "kb_payloads": payload_stats(knowledge_base.payloads),
+        "rag_ready": retriever.ready,
+        "llm_in_flight": llm_client.in_flight,
+        "llm_queued": llm_client.queued,
+        "llm_scheduler": llm_client.stats(),
+        "tickets_processed": ticket_store.processed,
+        "ticket_store": ticket_store.stats(),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Метрики в текстовом формате Prometheus, суммарно по всем воркерам."""
+    return PlainTextResponse(await asyncio.to_thread(metrics_registry.render, metrics_registry.snapshot()),
+                             media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     return {"message": "AI TechSupport System - Росатом"}
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+import tempfile
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Tuple, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Общий каталог воркеров одного uvicorn (родитель у них общий)
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "ai_techsupport_metrics", str(os.getppid())))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Доля тикетов, для которых пишется подробная разбивка по этапам
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"type": "counter", "help": self.help, "labels": list(self.labels),
+                "values": [[list(k), v] for k, v in self.values.items()]}
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [счетчики по корзинам (не накопительные)..., +Inf, sum]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        data = self.values.get(key)
+        if data is None:
+            data = self.values[key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+                break
+        else:
+            data[len(self.buckets)] += 1
+        data[-1] += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"type": "histogram", "help": self.help, "labels": list(self.labels),
+                "buckets": list(self.buckets), "values": [[list(k), v] for k, v in self.values.items()]}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: List[str], values: List[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class MetricsRegistry:
+    """Счетчики и гистограммы в формате Prometheus, общие для всех воркеров.
+
+    Каждый воркер периодически сохраняет свой снимок в METRICS_DIR/<pid>.json,
+    а /metrics складывает снимки всех воркеров. Запись в метрики - обычные
+    операции со словарем, без блокировок: воркер однопоточный.
+    """
+
+    def __init__(self, directory: str = METRICS_DIR):
+        self.directory = directory
+        self.metrics: Dict[str, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help_text, labels, buckets))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def write_snapshot(self, snapshot: Optional[Dict[str, Any]] = None):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(os.getpid()) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot if snapshot is not None else self.snapshot(), f)
+        os.replace(tmp, self._path(os.getpid()))
+
+    def remove_dead_workers(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                pid = int(name[:-len(".json")])
+                os.kill(pid, 0)
+            except ValueError:
+                continue
+            except ProcessLookupError:
+                os.remove(os.path.join(self.directory, name))
+            except PermissionError:
+                pass
+
+    def collect(self, own: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Сумма снимков всех воркеров; свой снимок берется свежим."""
+        snapshots = [own if own is not None else self.snapshot()]
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json") or name == f"{os.getpid()}.json":
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+
+        merged: Dict[str, Any] = {}
+        for snapshot in snapshots:
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, dict(metric, values={}))
+                for labels, value in metric["values"]:
+                    key = tuple(labels)
+                    if metric["type"] == "counter":
+                        target["values"][key] = target["values"].get(key, 0.0) + value
+                    else:
+                        current = target["values"].get(key)
+                        target["values"][key] = value if current is None else [a + b for a, b in zip(current, value)]
+        return merged
+
+    def render(self, own: Optional[Dict[str, Any]] = None) -> str:
+        """Текстовый формат Prometheus.
+
+        Если render вызывается в потоке, свой снимок нужно снять заранее в
+        event loop и передать в own: словари метрик меняются без блокировок.
+        """
+        lines: List[str] = []
+        for name, metric in sorted(self.collect(own).items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in sorted(metric["values"].items()):
+                labels = list(key)
+                if metric["type"] == "counter":
+                    lines.append(f"{name}{_labels(metric['labels'], labels)} {value}")
+                    continue
+                cumulative = 0.0
+                for bound, count in zip(metric["buckets"], value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(metric['labels'], labels, ('le', repr(bound)))} {cumulative}")
+                cumulative += value[len(metric["buckets"])]
+                lines.append(f"{name}_bucket{_labels(metric['labels'], labels, ('le', '+Inf'))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(metric['labels'], labels)} {value[-1]}")
+                lines.append(f"{name}_count{_labels(metric['labels'], labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                await asyncio.to_thread(self.write_snapshot, self.snapshot())
+            except Exception as e:
+                logger.error(f"Metrics snapshot failed: {e}")
+
+    def start(self):
+        try:
+            self.remove_dead_workers()
+        except OSError as e:
+            logger.warning(f"Metrics cleanup failed: {e}")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            self.write_snapshot()
+        except OSError as e:
+            logger.warning(f"Metrics snapshot failed: {e}")
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "ticket_stage_duration_seconds", "Время этапа обработки тикета", ("stage",))
+TICKET_SECONDS = registry.histogram(
+    "ticket_duration_seconds", "Полное время обработки тикета", ("source",))
+TICKETS_TOTAL = registry.counter(
+    "tickets_total", "Обработанные тикеты", ("category", "source", "needs_human"))
+LLM_TOKENS_TOTAL = registry.counter(
+    "llm_tokens_total", "Токены Ollama: prompt - контекст, eval - сгенерированные", ("kind",))
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 384, 512, 768, 1024, 1536, 2048, 4096)
+LLM_PROMPT_TOKENS = registry.histogram(
+    "llm_prompt_tokens", "Токены промпта на один вызов Ollama (без взятых из KV-кэша)", ("category",),
+    buckets=TOKEN_BUCKETS)
+LLM_COMPLETION_TOKENS = registry.histogram(
+    "llm_completion_tokens", "Сгенерированные токены на один вызов Ollama", ("category",),
+    buckets=TOKEN_BUCKETS)
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "llm_tokens_per_second", "Скорость генерации Ollama по eval_count/eval_duration",
+    buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200))
+
+
+# --- Трассировка тикета ---
+class Trace:
+    """Трасса одного запроса: trace_id и время по этапам (если запрос попал в выборку)."""
+
+    def __init__(self, sampled: bool = False, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Разбивка в формате заголовка Server-Timing (миллисекунды)."""
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages)
+
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def start_trace(force_sample: bool = False, trace_id: Optional[str] = None) -> Trace:
+    trace = Trace(sampled=force_sample or random.random() < TRACE_SAMPLE_RATE, trace_id=trace_id)
+    current_trace.set(trace)
+    return trace
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Замер этапа: в гистограмму всегда, в трассу - только для выборки."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, stage=name)
+        trace = current_trace.get()
+        if trace is not None and trace.sampled:
+            trace.stages.append((name, seconds))
+
+
+def record_llm_stats(data: Dict[str, Any], category: Optional[str] = None) -> Dict[str, int]:
+    """Статистика из финального ответа Ollama (eval_count, eval_duration в нс).
+
+    Возвращает число токенов вызова: prompt и completion.
+    """
+    prompt_tokens = data.get("prompt_eval_count") or 0
+    eval_tokens = data.get("eval_count") or 0
+    eval_duration = data.get("eval_duration") or 0
+    LLM_TOKENS_TOTAL.inc(prompt_tokens, kind="prompt")
+    LLM_TOKENS_TOTAL.inc(eval_tokens, kind="eval")
+    LLM_PROMPT_TOKENS.observe(prompt_tokens, category=category or "unknown")
+    LLM_COMPLETION_TOKENS.observe(eval_tokens, category=category or "unknown")
+    if eval_tokens and eval_duration:
+        LLM_TOKENS_PER_SECOND.observe(eval_tokens / (eval_duration / 1e9))
+    return {"prompt": prompt_tokens, "completion": eval_tokens}
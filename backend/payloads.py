@@ -0,0 +1,110 @@
+import os
+import json
+import zlib
+import struct
+from typing import Dict, List, Any, Optional, Iterable, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него работает стандартный json
+    orjson = None
+
+# Ответы статей от такого размера (байт JSON) сжимаются gzip заранее, при загрузке базы знаний (0 - не сжимать)
+KB_GZIP_MIN_SIZE = int(os.getenv("KB_GZIP_MIN_SIZE", "256"))
+KB_GZIP_LEVEL = int(os.getenv("KB_GZIP_LEVEL", "9"))
+
+# Заголовок gzip без имени файла и времени: один и тот же для всех ответов
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+# Длина stored-блока deflate ограничена 16 битами
+STORED_BLOCK_MAX = 0xFFFF
+
+
+def dumps(obj: Any) -> bytes:
+    """JSON в том же виде, что отдает FastAPI: UTF-8 без экранирования и без пробелов."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def deflate(data: bytes, mode: int) -> bytes:
+    """Сырой deflate; Z_SYNC_FLUSH заканчивает его по границе байта, и за ним можно продолжать поток."""
+    compressor = zlib.compressobj(KB_GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(mode)
+
+
+def stored_blocks(data: bytes) -> bytes:
+    """data несжатыми (stored) блоками deflate: их можно вклеивать между заранее сжатыми."""
+    blocks = []
+    for start in range(0, len(data), STORED_BLOCK_MAX):
+        chunk = data[start:start + STORED_BLOCK_MAX]
+        blocks.append(b"\x00" + struct.pack("<HH", len(chunk), len(chunk) ^ 0xFFFF) + chunk)
+    return b"".join(blocks)
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            q = params.replace(" ", "")
+            try:
+                return not (q.startswith("q=") and float(q[2:]) == 0)
+            except ValueError:
+                return True
+    return False
+
+
+class ArticlePayload:
+    """Тело TicketResponse для ответа статьей, собранное при загрузке базы знаний.
+
+    Текст ответа и шаги сериализуются один раз; на запрос подставляются
+    только ticket_id, category, confidence и needs_human, порядок полей как
+    у TicketResponse. Длинный ответ заранее сжат deflate (с выравниванием по
+    байту в конце), и сжатое тело тикета склеивается из него и несжатых
+    блоков с полями запроса - без сжатия на каждый запрос.
+    """
+
+    def __init__(self, article: Dict[str, Any], gzip_min_size: int = KB_GZIP_MIN_SIZE):
+        self.article = article
+        self.response = dumps(article["answer"])
+        # Поля после needs_human у статьи не меняются - сериализуются и сжимаются вместе с ответом
+        self.tail = b',"solution_steps":' + dumps(article.get("steps", [])) + b',"tokens":null}'
+        self.deflated: Optional[Tuple[bytes, bytes]] = None
+        if gzip_min_size and len(self.response) >= gzip_min_size:
+            self.deflated = (deflate(self.response, zlib.Z_SYNC_FLUSH), deflate(self.tail, zlib.Z_FINISH))
+
+    def _fields(self, category: str, confidence: float, needs_human: bool) -> bytes:
+        return (b',"category":' + dumps(category) + b',"confidence":' + dumps(confidence)
+                + b',"source":"knowledge_base","needs_human":' + (b"true" if needs_human else b"false"))
+
+    def render(self, ticket_id: str, category: str, confidence: float, needs_human: bool) -> bytes:
+        return b"".join((b'{"ticket_id":', dumps(ticket_id), b',"response":', self.response,
+                         self._fields(category, confidence, needs_human), self.tail))
+
+    def render_gzip(self, ticket_id: str, category: str, confidence: float, needs_human: bool) -> Optional[bytes]:
+        """То же тело в gzip или None, если ответ статьи слишком короткий и заранее не сжимался."""
+        if self.deflated is None:
+            return None
+        head = b'{"ticket_id":' + dumps(ticket_id) + b',"response":'
+        fields = self._fields(category, confidence, needs_human)
+        # CRC считается по всему телу, но сжимать на запрос ничего не нужно
+        crc = zlib.crc32(head)
+        for part in (self.response, fields, self.tail):
+            crc = zlib.crc32(part, crc)
+        size = len(head) + len(self.response) + len(fields) + len(self.tail)
+        return b"".join((GZIP_HEADER, stored_blocks(head), self.deflated[0], stored_blocks(fields), self.deflated[1],
+                         struct.pack("<II", crc, size & 0xFFFFFFFF)))
+
+
+def build_payloads(articles: Iterable[Dict[str, Any]]) -> Dict[str, ArticlePayload]:
+    return {article["id"]: ArticlePayload(article) for article in articles}
+
+
+def payload_stats(payloads: Dict[str, ArticlePayload]) -> Dict[str, Any]:
+    compressed: List[ArticlePayload] = [p for p in payloads.values() if p.deflated is not None]
+    return {
+        "articles": len(payloads),
+        "gzip": len(compressed),
+        "bytes": sum(len(p.response) + len(p.tail) for p in compressed),
+        "gzip_bytes": sum(len(p.deflated[0]) + len(p.deflated[1]) for p in compressed),
+        "encoder": "orjson" if orjson is not None else "json",
+    }
@@ -0,0 +1,132 @@
+import os
+import re
+from typing import Dict, List, Any, Optional
+
+from agents.kb_index import tokenize
+
+# Системная часть одинакова для всех тикетов: Ollama переиспользует ее KV-кэш,
+# пока модель в памяти (keep_alive), и не пересчитывает эти токены заново
+SYSTEM_PROMPT = (
+    "Ты - AI-ассистент техподдержки Росатом. Отвечай четко, по шагам. "
+    "Если не уверен, предлагай обратиться к оператору."
+)
+
+# Размер окна модели. Должен быть одинаковым во всех запросах: при смене num_ctx Ollama перезагружает модель
+LLM_NUM_CTX = int(os.getenv("LLM_NUM_CTX", "2048"))
+# Бюджеты в токенах на справку (статья + абзацы RAG) и на текст тикета
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "400"))
+LLM_MESSAGE_TOKENS = int(os.getenv("LLM_MESSAGE_TOKENS", "300"))
+LLM_NUM_PREDICT = int(os.getenv("LLM_NUM_PREDICT", "256"))
+# Длина ответа по категориям: на приветствие хватит пары фраз
+NUM_PREDICT_BY_CATEGORY = {
+    "greeting": 64,
+    "other": 192,
+}
+
+STEP_PATTERN = re.compile(r"^\s*(\d+[.)]|[-•*])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов без токенизатора модели.
+
+    Словари phi3/llama кодируют латиницу примерно по 4 символа на токен,
+    а кириллицу - по 2, поэтому символы считаются с разным весом.
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars + 1) // 2
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    if estimate_tokens(text) <= budget:
+        return text
+    # Бинарный поиск по длине префикса; обрезаем по границе слова
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text[:low]
+    return (cut.rsplit(" ", 1)[0] if " " in cut else cut) + "…"
+
+
+def relevant_lines(text: str, query_tokens: set) -> List[str]:
+    """Строки статьи, относящиеся к запросу: заголовок и шаги с общими словами.
+
+    Если ни один шаг не пересекается с запросом, остаются все шаги: общая
+    инструкция полезнее пустой справки. Прочие строки (примечания) - только
+    при совпадении слов.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+    header = [lines[0]] if lines[0].endswith(":") else []
+    body = lines[len(header):]
+    steps = [line for line in body if STEP_PATTERN.match(line)]
+    matching = [line for line in body if query_tokens & set(tokenize(line))]
+    matching_steps = [line for line in matching if STEP_PATTERN.match(line)]
+    keep = set(matching) | set(steps if not matching_steps else matching_steps)
+    return header + [line for line in body if line in keep]
+
+
+def build_reference(message: str, context: Optional[Dict[str, Any]], budget: int) -> str:
+    """Текст справки из контекста (similar_solution, passages) не длиннее budget токенов."""
+    if not context or budget <= 0:
+        return ""
+    query_tokens = set(tokenize(message))
+    sources = ([context["similar_solution"]] if context.get("similar_solution") else []) + context.get("passages", [])
+    parts: List[str] = []
+    seen: set = set()
+    for source in sources:
+        # Абзацы RAG часто повторяют строки статьи - каждую строку берем один раз
+        lines = [line for line in relevant_lines(source, query_tokens) if line not in seen]
+        seen.update(lines)
+        if lines:
+            parts.append("\n".join(lines))
+
+    reference: List[str] = []
+    used = 0
+    for part in parts:
+        cost = estimate_tokens(part) + 1
+        if used + cost > budget:
+            remaining = budget - used
+            # Хвост бюджета отдаем обрезанному фрагменту, если он не совсем крошечный
+            if remaining >= 32:
+                reference.append(truncate_tokens(part, remaining - 1))
+            break
+        reference.append(part)
+        used += cost
+    return "\n\n".join(reference)
+
+
+def num_predict(category: Optional[str]) -> int:
+    return NUM_PREDICT_BY_CATEGORY.get(category, LLM_NUM_PREDICT)
+
+
+def build_prompt(message: str, context: Optional[Dict[str, Any]], category: Optional[str] = None) -> Dict[str, Any]:
+    """Сообщения и опции для /api/chat плюс оценка числа токенов промпта.
+
+    Переменная часть (сводка диалога, справка и текст тикета) идет в сообщение
+    пользователя после неизменной системной части. Сводку (context["history"])
+    заранее ограничивает SessionStore. Справка ужимается до LLM_CONTEXT_TOKENS,
+    а если окна все равно не хватает - еще сильнее, ответ не вытесняется.
+    """
+    predict = num_predict(category)
+    user_text = truncate_tokens(message.strip(), LLM_MESSAGE_TOKENS)
+    history = (context or {}).get("history", "")
+    fixed = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(user_text) + estimate_tokens(history) + 16
+    budget = min(LLM_CONTEXT_TOKENS, LLM_NUM_CTX - predict - fixed)
+    # В уточнении ("не помогло") своих слов мало: строки справки выбираем и по сводке диалога
+    reference = build_reference(f"{message} {history}" if history else message, context, budget)
+    if reference:
+        user_text = f"Справка:\n{reference}\n\nВопрос: {user_text}"
+    if history:
+        user_text = f"Ранее в диалоге:\n{history}\n\n{user_text}"
+    messages = [{"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_text}]
+    return {
+        "messages": messages,
+        "options": {"temperature": 0.3, "num_ctx": LLM_NUM_CTX, "num_predict": predict},
+        "estimated_tokens": sum(estimate_tokens(m["content"]) for m in messages),
+    }
@@ -0,0 +1,149 @@
+import re
+import time
+import zlib
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    text = _NON_WORD.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+class ResponseCache:
+    """Кэш ответов LLM для повторяющихся и почти одинаковых тикетов.
+
+    Сначала ищется точное совпадение по нормализованному тексту и контексту,
+    затем ближайший сосед по косинусной близости хэшированных символьных
+    триграмм среди записей с тем же контекстом. Вектора хранятся в заранее
+    выделенной матрице max_size x dim, поэтому поиск соседа - одно умножение
+    матрицы на вектор. Вытеснение - по TTL и LRU.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0,
+                 similarity: float = 0.9, dim: int = 2048):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.dim = dim
+
+        self._vectors = np.zeros((max_size, dim), dtype=np.float32)
+        self._active = np.zeros(max_size, dtype=bool)
+        self._context_ids = np.zeros(max_size, dtype=np.int64)
+        self._free = list(range(max_size - 1, -1, -1))
+        # key -> (slot, response, expires_at); порядок = порядок использования
+        self._entries: "OrderedDict[str, Tuple[int, str, float]]" = OrderedDict()
+        self._slot_keys: Dict[int, str] = {}
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _context_id(context: Optional[Dict[str, Any]]) -> int:
+        if not context:
+            return 0
+        raw = repr(sorted(context.items())).encode("utf-8")
+        return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "little", signed=True)
+
+    @staticmethod
+    def _key(normalized: str, context_id: int) -> str:
+        return f"{context_id}:{normalized}"
+
+    def _vectorize(self, normalized: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        padded = f" {normalized} "
+        for i in range(len(padded) - 2):
+            vec[zlib.crc32(padded[i:i + 3].encode("utf-8")) % self.dim] += 1.0
+        norm = np.linalg.norm(vec)
+        if norm:
+            vec /= norm
+        return vec
+
+    def _remove(self, key: str):
+        slot, _, _ = self._entries.pop(key)
+        self._active[slot] = False
+        del self._slot_keys[slot]
+        self._free.append(slot)
+
+    def _touch(self, key: str) -> Optional[str]:
+        slot, response, expires_at = self._entries[key]
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def get(self, message: str, context: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        normalized = normalize_text(message)
+        if not normalized:
+            return None
+        context_id = self._context_id(context)
+        key = self._key(normalized, context_id)
+
+        if key in self._entries:
+            response = self._touch(key)
+            if response is not None:
+                self.hits += 1
+                return response
+
+        if self._entries:
+            mask = self._active & (self._context_ids == context_id)
+            if mask.any():
+                scores = self._vectors @ self._vectorize(normalized)
+                scores[~mask] = -1.0
+                slot = int(scores.argmax())
+                if scores[slot] >= self.similarity:
+                    response = self._touch(self._slot_keys[slot])
+                    if response is not None:
+                        self.hits += 1
+                        self.semantic_hits += 1
+                        return response
+
+        self.misses += 1
+        return None
+
+    def put(self, message: str, context: Optional[Dict[str, Any]], response: str):
+        normalized = normalize_text(message)
+        if not normalized:
+            return
+        context_id = self._context_id(context)
+        key = self._key(normalized, context_id)
+
+        if key in self._entries:
+            self._remove(key)
+        if not self._free:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+        slot = self._free.pop()
+        self._vectors[slot] = self._vectorize(normalized)
+        self._active[slot] = True
+        self._context_ids[slot] = context_id
+        self._slot_keys[slot] = key
+        self._entries[key] = (slot, response, time.monotonic() + self.ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
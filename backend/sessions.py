@@ -0,0 +1,148 @@
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Any, Optional
+
+from prompt_builder import estimate_tokens, truncate_tokens
+from response_cache import normalize_text
+
+# Сколько пользователей держать в памяти воркера и сколько секунд молчания закрывает диалог
+SESSION_MAX_USERS = int(os.getenv("SESSION_MAX_USERS", "5000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+# Последние реплики в сводке и ее предельный размер в токенах
+SESSION_TURNS = int(os.getenv("SESSION_TURNS", "3"))
+SESSION_SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", "200"))
+# Уточнение - короткое сообщение; длиннее считается новым обращением
+SESSION_FOLLOW_UP_WORDS = int(os.getenv("SESSION_FOLLOW_UP_WORDS", "8"))
+# Ниже этой уверенности классификатор не спорит с темой диалога
+SESSION_NEW_TOPIC_CONFIDENCE = float(os.getenv("SESSION_NEW_TOPIC_CONFIDENCE", "0.5"))
+
+# Фразы, которыми пишут продолжение, а не новую проблему (после normalize_text)
+FOLLOW_UP_MARKERS = (
+    "не помогл", "все еще", "до сих пор", "по прежнему", "так и не", "опять", "снова",
+    "не получ", "не вышло", "не работает", "что дальше", "а если", "еще раз", "тоже",
+)
+# Длина одной реплики в сводке
+TURN_TOKENS = 40
+
+
+def has_follow_up_marker(message: str) -> bool:
+    normalized = normalize_text(message)
+    return any(marker in normalized for marker in FOLLOW_UP_MARKERS)
+
+
+class Session:
+    """Диалог пользователя: тема (классификация и найденные статьи) и сводка последних реплик.
+
+    Полная переписка не хранится: тема фиксируется первым сообщением, а в
+    сводке остаются SESSION_TURNS последних пар "вопрос - ответ", каждая
+    обрезанная до TURN_TOKENS. Поэтому промпт уточнения ограничен
+    SESSION_SUMMARY_TOKENS, сколько бы сообщений ни было в диалоге.
+    """
+
+    def __init__(self, user_id: str, message: str, classification: Dict[str, Any],
+                 kb_result: Optional[Dict[str, Any]], passages: List[Dict[str, Any]]):
+        self.user_id = user_id
+        self.classification = classification
+        self.kb_result = kb_result
+        self.passages = passages
+        self.topic = truncate_tokens(message.strip(), TURN_TOKENS)
+        self.turns: "deque[str]" = deque(maxlen=SESSION_TURNS)
+        self.count = 0
+        self.summary = ""
+        self.updated = time.monotonic()
+
+    def add_turn(self, message: str, answer: str, source: str):
+        # Из ответа берем первую строку: обычно в ней суть, шаги модель увидит в справке
+        first_line = next((line.strip() for line in answer.splitlines() if line.strip()), "")
+        self.turns.append(f"Пользователь: {truncate_tokens(message.strip(), TURN_TOKENS)}\n"
+                          f"Ответ ({source}): {truncate_tokens(first_line, TURN_TOKENS)}")
+        self.count += 1
+        self.updated = time.monotonic()
+        self.summary = self._summarize()
+
+    def _summarize(self) -> str:
+        header = f"Тема: {self.classification['category']}"
+        if self.kb_result:
+            header += f"\nВыдана статья: {self.kb_result.get('question', self.kb_result.get('id', ''))}"
+        if self.count > len(self.turns):
+            # Начало диалога вышло из окна реплик - оставляем от него только первое сообщение
+            header += f"\nПервое сообщение: {self.topic}\nРеплик до этого: {self.count - len(self.turns)}"
+        turns = list(self.turns)
+        # Старые реплики уходят первыми, пока сводка не влезет в бюджет
+        while turns and estimate_tokens("\n".join([header] + turns)) > SESSION_SUMMARY_TOKENS:
+            turns.pop(0)
+        return truncate_tokens("\n".join([header] + turns), SESSION_SUMMARY_TOKENS)
+
+    def is_follow_up(self, message: str, classification: Dict[str, Any]) -> bool:
+        """Продолжает ли сообщение этот диалог, а не начинает новую тему.
+
+        Уточнение короткое и либо содержит фразу продолжения ("не помогло",
+        "все еще"), либо классификатор не нашел в нем категории. Другая
+        категория, в которой классификатор уверен, - новая тема.
+        """
+        if len(normalize_text(message).split()) > SESSION_FOLLOW_UP_WORDS:
+            return False
+        category = classification["category"]
+        if not (category == "other" or has_follow_up_marker(message)):
+            return False
+        return (category in ("other", self.classification["category"])
+                or classification["confidence"] < SESSION_NEW_TOPIC_CONFIDENCE)
+
+
+class SessionStore:
+    """Диалоги по user_id в памяти воркера: LRU на SESSION_MAX_USERS пользователей и TTL.
+
+    Хранилище у каждого воркера свое; при нескольких воркерах уточнение,
+    попавшее в другой воркер, обрабатывается как новое обращение.
+    """
+
+    def __init__(self, max_size: int = SESSION_MAX_USERS, ttl: float = SESSION_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.follow_ups = 0
+        self.started = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, user_id: str) -> Optional[Session]:
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+        if time.monotonic() - session.updated > self.ttl:
+            del self._sessions[user_id]
+            self.expired += 1
+            return None
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def follow_up(self, user_id: str, message: str, classification: Dict[str, Any]) -> Optional[Session]:
+        """Диалог, который продолжает сообщение, или None для нового обращения."""
+        session = self.get(user_id)
+        if session is None or not session.is_follow_up(message, classification):
+            return None
+        self.follow_ups += 1
+        return session
+
+    def start(self, user_id: str, message: str, classification: Dict[str, Any],
+              kb_result: Optional[Dict[str, Any]], passages: List[Dict[str, Any]]) -> Session:
+        """Новый диалог пользователя; предыдущий, если был, заменяется."""
+        session = Session(user_id, message, classification, kb_result, passages)
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        self.started += 1
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+        return session
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._sessions),
+            "max_size": self.max_size,
+            "started": self.started,
+            "follow_ups": self.follow_ups,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
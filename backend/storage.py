@@ -0,0 +1,260 @@
+import os
+import base64
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import List, Optional, Dict, Any, AsyncIterator, Tuple
+
+from sqlalchemy import (
+    Boolean, Column, DateTime, Float, Integer, MetaData, String, Table, Text,
+    create_engine, event, func, insert, select,
+)
+from sqlalchemy.exc import DataError, IntegrityError
+
+logger = logging.getLogger(__name__)
+
+TICKETS_DB_URL = os.getenv(
+    "TICKETS_DB_URL",
+    "sqlite:///" + os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "tickets.db")
+)
+TICKETS_RECENT_SIZE = int(os.getenv("TICKETS_RECENT_SIZE", "1000"))
+TICKETS_FLUSH_INTERVAL = float(os.getenv("TICKETS_FLUSH_INTERVAL", "0.5"))
+TICKETS_BATCH_SIZE = int(os.getenv("TICKETS_BATCH_SIZE", "200"))
+TICKETS_MAX_PENDING = int(os.getenv("TICKETS_MAX_PENDING", "10000"))
+
+metadata = MetaData()
+
+tickets_table = Table(
+    "tickets",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("ticket_id", String(32), nullable=False, unique=True),
+    Column("user_id", String(255), nullable=False, index=True),
+    Column("message", Text, nullable=False),
+    Column("response", Text, nullable=False),
+    Column("category", String(64), index=True),
+    Column("source", String(32), nullable=False, index=True),
+    Column("confidence", Float),
+    Column("needs_human", Boolean, nullable=False, default=False),
+    Column("timestamp", DateTime, nullable=False, index=True),
+)
+
+
+HISTORY_FIELDS = [c.name for c in tickets_table.columns if c.name != "id"]
+
+
+def encode_cursor(ticket_pk: int) -> str:
+    return base64.urlsafe_b64encode(str(ticket_pk).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    record = dict(row._mapping)
+    record.pop("id", None)
+    if "timestamp" in record:
+        record["timestamp"] = record["timestamp"].isoformat()
+    return record
+
+
+class TicketStore:
+    """Хранилище тикетов в SQL базе (по умолчанию SQLite в режиме WAL).
+
+    add() не ходит в базу: запись кладется в буфер, который фоновая задача
+    раз в TICKETS_FLUSH_INTERVAL секунд (или при накоплении TICKETS_BATCH_SIZE
+    записей) пишет одной транзакцией в отдельном потоке. Последние
+    TICKETS_RECENT_SIZE тикетов воркера держатся в кольцевом буфере,
+    поэтому память не растет с числом обработанных тикетов.
+
+    Если пачка не записалась из-за самих данных (например, повтор
+    ticket_id), она пишется построчно, а не прошедшие записи отбрасываются
+    (rejected); при недоступной базе пачка возвращается в очередь.
+    """
+
+    def __init__(self, url: str = TICKETS_DB_URL, recent_size: int = TICKETS_RECENT_SIZE):
+        self.url = url
+        self.recent: deque = deque(maxlen=recent_size)
+        self._pending: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self.total = 0
+        self.dropped = 0
+        self.rejected = 0
+
+        if url.startswith("sqlite:///"):
+            os.makedirs(os.path.dirname(url[len("sqlite:///"):]) or ".", exist_ok=True)
+            self.engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 30})
+            event.listen(self.engine, "connect", self._sqlite_pragmas)
+        else:
+            self.engine = create_engine(url, pool_pre_ping=True)
+        metadata.create_all(self.engine)
+        self.total = self._count()
+
+    @staticmethod
+    def _sqlite_pragmas(dbapi_connection, _):
+        # WAL позволяет воркерам читать, пока другой воркер пишет
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    def _count(self) -> int:
+        # max(id) по первичному ключу - O(1), в отличие от count(*)
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.max(tickets_table.c.id))).scalar() or 0
+
+    def add(self, record: Dict[str, Any]):
+        self.recent.append(record)
+        if len(self._pending) >= TICKETS_MAX_PENDING:
+            # База не успевает или недоступна: теряем самые старые записи, а не память
+            self._pending.popleft()
+            self.dropped += 1
+        self._pending.append(record)
+        if len(self._pending) >= TICKETS_BATCH_SIZE:
+            self._wakeup.set()
+
+    def get_recent(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        for record in reversed(self.recent):
+            if record["ticket_id"] == ticket_id:
+                return record
+        return None
+
+    def _write(self, batch: List[Dict[str, Any]]) -> int:
+        rows = [dict(r, timestamp=datetime.fromisoformat(r["timestamp"])) for r in batch]
+        with self.engine.begin() as conn:
+            conn.execute(insert(tickets_table), rows)
+            return conn.execute(select(func.max(tickets_table.c.id))).scalar() or 0
+
+    async def _write_each(self, batch: List[Dict[str, Any]]) -> bool:
+        """Пишет пачку по одной записи; False, если база недоступна и остаток вернулся в очередь."""
+        for i, record in enumerate(batch):
+            try:
+                self.total = await asyncio.to_thread(self._write, [record])
+            except (IntegrityError, DataError) as e:
+                # Запись не пройдет и при повторе: отбрасываем ее, а не блокируем очередь
+                self.rejected += 1
+                logger.error(f"Ticket {record.get('ticket_id')} rejected by the store: {e.orig}")
+            except Exception as e:
+                logger.error(f"Ticket store write failed: {e}")
+                self._pending.extendleft(reversed(batch[i:]))
+                return False
+        return True
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(TICKETS_BATCH_SIZE, len(self._pending)))]
+                try:
+                    self.total = await asyncio.to_thread(self._write, batch)
+                except (IntegrityError, DataError) as e:
+                    logger.warning(f"Ticket batch of {len(batch)} rejected ({e.orig}), writing one by one")
+                    if not await self._write_each(batch):
+                        break
+                except Exception as e:
+                    logger.error(f"Ticket store write failed: {e}")
+                    # Вернем записи в начало очереди и попробуем в следующий раз
+                    self._pending.extendleft(reversed(batch))
+                    break
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=TICKETS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def _fetch(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            row = conn.execute(select(tickets_table).where(tickets_table.c.ticket_id == ticket_id)).first()
+        return _row_to_dict(row) if row else None
+
+    async def get(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        record = self.get_recent(ticket_id)
+        if record is None:
+            record = await asyncio.to_thread(self._fetch, ticket_id)
+        return record
+
+    def _select(self, filters: Dict[str, Any], fields: Optional[List[str]], before_id: Optional[int], limit: int):
+        columns = [tickets_table.c.id] + [tickets_table.c[f] for f in (fields or HISTORY_FIELDS)]
+        query = select(*columns)
+        for name in ("user_id", "category", "source", "needs_human"):
+            if filters.get(name) is not None:
+                query = query.where(tickets_table.c[name] == filters[name])
+        if filters.get("since") is not None:
+            query = query.where(tickets_table.c.timestamp >= filters["since"])
+        if filters.get("until") is not None:
+            query = query.where(tickets_table.c.timestamp < filters["until"])
+        if before_id is not None:
+            query = query.where(tickets_table.c.id < before_id)
+        # Keyset-пагинация по первичному ключу: страница стоит одинаково и в начале, и в конце таблицы
+        return query.order_by(tickets_table.c.id.desc()).limit(limit)
+
+    def _page(self, filters: Dict[str, Any], fields: Optional[List[str]],
+              before_id: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(self._select(filters, fields, before_id, limit)).all()
+        next_id = rows[-1].id if len(rows) == limit else None
+        return [_row_to_dict(row) for row in rows], next_id
+
+    async def page(self, filters: Dict[str, Any], fields: Optional[List[str]] = None,
+                   cursor: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+        """Страница тикетов всех воркеров, от новых к старым.
+
+        cursor - значение next_cursor с предыдущей страницы; fields ограничивает
+        набор полей (например, без response, чтобы не тянуть тексты ответов).
+        """
+        if cursor is None:
+            # Первая страница должна видеть и тикеты, еще лежащие в буфере записи
+            await self.flush()
+        before_id = decode_cursor(cursor) if cursor is not None else None
+        items, next_id = await asyncio.to_thread(self._page, filters, fields, before_id, limit)
+        return {"items": items, "next_cursor": encode_cursor(next_id) if next_id is not None else None}
+
+    async def export(self, filters: Dict[str, Any], fields: Optional[List[str]] = None,
+                     batch_size: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+        """Все подходящие тикеты пачками по batch_size - в памяти только одна пачка."""
+        await self.flush()
+        before_id = None
+        while True:
+            items, before_id = await asyncio.to_thread(self._page, filters, fields, before_id, batch_size)
+            for item in items:
+                yield item
+            if before_id is None:
+                break
+
+    @property
+    def processed(self) -> int:
+        return self.total + len(self._pending)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stored": self.total,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "recent": len(self.recent),
+        }
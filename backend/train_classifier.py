@@ -0,0 +1,51 @@
+"""Обучение классификатора тикетов.
+
+Пример:
+    python train_classifier.py
+    python train_classifier.py --data training/tickets.jsonl -o data/classifier.joblib
+
+Обучающая выборка - JSONL с полями message и category плюс вопросы и
+триггеры статей базы знаний. Модель сохраняется в CLASSIFIER_MODEL_PATH;
+воркеры загружают ее при первой классификации.
+"""
+import sys
+import time
+import argparse
+from collections import Counter
+
+from agents.ml_classifier import (
+    CLASSIFIER_MODEL_PATH, CLASSIFIER_TRAINING_PATH, TicketClassifier, load_examples, build_pipeline,
+)
+from agents.rag_search import KB_DIR
+
+
+def cross_validate(texts, labels, folds: int = 5) -> float:
+    from sklearn.model_selection import cross_val_score, StratifiedKFold
+
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=0)
+    return float(cross_val_score(build_pipeline(), texts, labels, cv=splitter).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обучение классификатора тикетов (TF-IDF + логистическая регрессия)")
+    parser.add_argument("--data", default=CLASSIFIER_TRAINING_PATH, help="Размеченные тикеты JSONL")
+    parser.add_argument("--kb-dir", default=KB_DIR, help="Каталог базы знаний ('' - без статей)")
+    parser.add_argument("-o", "--output", default=CLASSIFIER_MODEL_PATH, help="Куда сохранить модель")
+    parser.add_argument("--no-calibrate", action="store_true", help="Не подбирать temperature")
+    parser.add_argument("--cv", action="store_true", help="Вывести точность на кросс-валидации")
+    args = parser.parse_args()
+
+    texts, labels = load_examples(args.data, args.kb_dir or None)
+    print(f"Examples: {len(texts)} {dict(Counter(labels))}", file=sys.stderr)
+    if args.cv:
+        print(f"Cross-validation accuracy: {cross_validate(texts, labels):.3f}", file=sys.stderr)
+
+    started = time.monotonic()
+    classifier = TicketClassifier.train(texts, labels, calibrate=not args.no_calibrate)
+    classifier.save(args.output)
+    print(f"Saved {args.output} in {time.monotonic() - started:.1f}s, temperature {classifier.temperature:.3f}",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Офлайн-разбор выгрузки тикетов без HTTP API.
+
+Каждый тикет классифицируется (SimpleClassifier: обученная модель и ключевые
+слова) и ищется в базе знаний (SimpleKnowledgeBase: триггеры и BM25) так же,
+как в /tickets/. По результату видно, куда ушел бы тикет: ответ статьей,
+LLM или оператор. Это позволяет оценить нужную мощность LLM до прихода трафика.
+
+Примеры:
+    python triage.py ../requests.txt -o triage.jsonl
+    python triage.py dump.jsonl.gz --workers 8 --chunk-size 5000 -o triage.jsonl.gz --stats stats.json
+    cat dump.txt | python triage.py - > triage.jsonl
+
+Вход - текст (одна строка - один тикет, как requests.txt) или JSONL с полем
+message (остальные поля, например ticket_id, переносятся в результат);
+.gz читается и пишется на лету. Файл читается потоком пачками по
+--chunk-size, пачки обрабатывает пул из --workers процессов, и в работе
+одновременно не больше двух пачек на процесс, так что память не зависит от
+размера выгрузки. Результаты пишутся в исходном порядке.
+
+Поиск по эмбеддингам (RAG) не используется, поэтому доля ответов статьей -
+оценка снизу. Сводка (распределение категорий, доля попаданий в базу
+знаний, сколько тикетов ушло бы в LLM и оператору) печатается в stderr и
+сохраняется в --stats.
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import argparse
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterator, Tuple, IO
+
+# Уверенность ответа LLM, которую назначает resolve_answer
+LLM_ANSWER_CONFIDENCE = 0.6
+
+_main = None
+_classifier = None
+
+
+def open_text(path: str, mode: str) -> IO[str]:
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def read_tickets(f: IO[str], fmt: str = "auto") -> Iterator[Dict[str, Any]]:
+    """Тикеты из текста или JSONL; формат auto определяется по первой непустой строке."""
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        if fmt == "auto":
+            fmt = "jsonl" if line.startswith("{") else "text"
+        if fmt == "text":
+            yield {"message": line}
+            continue
+        record = json.loads(line)
+        if isinstance(record.get("message"), str):
+            yield record
+
+
+def chunked(records: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk: List[Dict[str, Any]] = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def init_worker():
+    """Один раз на процесс: импорт main и загрузка модели классификатора."""
+    global _main, _classifier
+    # Хранилище тикетов и RAG разбору не нужны; main создает их при импорте
+    os.environ["TICKETS_DB_URL"] = "sqlite:///:memory:"
+    os.environ["RAG_ENABLED"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    _main = main
+    # Модель ждем сразу: иначе первые пачки классифицировались бы только ключевыми словами
+    _classifier = main.SimpleClassifier(main.knowledge_base.matcher, main.get_ticket_model(wait=True))
+
+
+def triage_chunk(records: List[Dict[str, Any]]) -> Tuple[str, Dict[str, Any]]:
+    """Пачка тикетов -> строки JSONL с результатами и частичная сводка."""
+    main = _main
+    messages = [r["message"] for r in records]
+    matches = [main.knowledge_base.matcher.find(m) for m in messages]
+    classifications = _classifier.classify_batch(messages, matches)
+
+    lines = []
+    stats = {"tickets": 0, "categories": Counter(), "routes": Counter(), "needs_human": 0, "articles": Counter()}
+    for record, message, mt, classification in zip(records, messages, matches, classifications):
+        category = classification["category"]
+        kb_result = main.knowledge_base.search(message, category, mt, main.is_trusted(classification))
+        if main.is_confident_kb_hit(kb_result):
+            route, confidence = "knowledge_base", kb_result["confidence"]
+            stats["articles"][kb_result["id"]] += 1
+        else:
+            route, confidence = "llm", LLM_ANSWER_CONFIDENCE
+        needs_human = main.needs_operator(message, category, confidence)
+
+        stats["tickets"] += 1
+        stats["categories"][category] += 1
+        stats["routes"][route] += 1
+        stats["needs_human"] += needs_human
+        lines.append(json.dumps({
+            **record,
+            "category": category,
+            "confidence": round(classification["confidence"], 4),
+            "kb_article": kb_result["id"] if kb_result else None,
+            "route": route,
+            "needs_human": needs_human,
+        }, ensure_ascii=False) + "\n")
+    return "".join(lines), stats
+
+
+def merge_stats(total: Dict[str, Any], part: Dict[str, Any]):
+    for key, value in part.items():
+        if isinstance(value, Counter):
+            total.setdefault(key, Counter()).update(value)
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+def summarize(stats: Dict[str, Any], seconds: float, top: int = 10) -> Dict[str, Any]:
+    tickets = stats.get("tickets", 0)
+    routes = stats.get("routes", Counter())
+
+    def share(n: int) -> float:
+        return round(n / tickets, 4) if tickets else 0.0
+
+    return {
+        "tickets": tickets,
+        "seconds": round(seconds, 2),
+        "tickets_per_second": round(tickets / seconds, 1) if seconds else None,
+        "categories": dict(stats.get("categories", Counter()).most_common()),
+        "kb_hits": routes["knowledge_base"],
+        "kb_hit_rate": share(routes["knowledge_base"]),
+        "llm": routes["llm"],
+        "llm_rate": share(routes["llm"]),
+        "needs_human": stats.get("needs_human", 0),
+        "needs_human_rate": share(stats.get("needs_human", 0)),
+        "top_articles": dict(stats.get("articles", Counter()).most_common(top)),
+    }
+
+
+def run(source: IO[str], output: IO[str], workers: int, chunk_size: int, fmt: str = "auto") -> Dict[str, Any]:
+    started = time.monotonic()
+    stats: Dict[str, Any] = {}
+    chunks = chunked(read_tickets(source, fmt), chunk_size)
+
+    if workers <= 1:
+        init_worker()
+        for chunk in chunks:
+            lines, part = triage_chunk(chunk)
+            output.write(lines)
+            merge_stats(stats, part)
+        return summarize(stats, time.monotonic() - started)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        # Ограниченное окно пачек: чтение не убегает вперед обработки, порядок сохраняется
+        pending: deque = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(triage_chunk, chunk))
+            if len(pending) >= workers * 2:
+                lines, part = pending.popleft().result()
+                output.write(lines)
+                merge_stats(stats, part)
+        while pending:
+            lines, part = pending.popleft().result()
+            output.write(lines)
+            merge_stats(stats, part)
+    return summarize(stats, time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-разбор выгрузки тикетов: категория, статья, маршрут")
+    parser.add_argument("input", help="Текст (строка - тикет) или JSONL с полем message; '-' - stdin; .gz")
+    parser.add_argument("-o", "--output", default="-", help="Результаты JSONL ('-' - stdout; .gz - сжать)")
+    parser.add_argument("--format", choices=["auto", "text", "jsonl"], default="auto")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Процессов (1 - без пула)")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Тикетов в пачке")
+    parser.add_argument("--stats", help="Куда сохранить сводку JSON")
+    args = parser.parse_args()
+
+    source = open_text(args.input, "r")
+    output = open_text(args.output, "w")
+    try:
+        summary = run(source, output, args.workers, args.chunk_size, args.format)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+        else:
+            output.flush()
+
+    print(json.dumps(summary, ensure_ascii=False, indent=2), file=sys.stderr)
+    if args.stats:
+        with open(args.stats, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Any, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+# Когда грузить тяжелые компоненты (модели, индексы):
+#   background - в фоне сразу после старта, порт открывается не дожидаясь их;
+#   lazy       - при первом использовании;
+#   eager      - до приема запросов (старт дольше, зато первый тикет без деградации)
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background")
+STARTUP_MODES = ("background", "lazy", "eager")
+
+
+class Component:
+    """Тяжелый компонент воркера и состояние его загрузки."""
+
+    PENDING = "pending"
+    LOADING = "loading"
+    READY = "ready"
+    # Компонент выключен настройкой или ему нечего грузить (например, модель не обучена)
+    DISABLED = "disabled"
+    FAILED = "failed"
+
+    def __init__(self, name: str, load: Callable[[], Awaitable[bool]], required: bool = True,
+                 enabled: bool = True):
+        self.name = name
+        self.load = load
+        self.required = required
+        self.state = self.PENDING if enabled else self.DISABLED
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def settled(self) -> bool:
+        return self.state in (self.READY, self.DISABLED, self.FAILED)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "required": self.required,
+            "seconds": None if self.seconds is None else round(self.seconds, 3),
+            "error": self.error,
+        }
+
+
+class Warmup:
+    """Загрузка тяжелых компонентов по STARTUP_MODE и готовность воркера (readiness).
+
+    Живость (liveness) - процесс отвечает на запросы; готовность - загружены
+    все обязательные компоненты. Пока воркер не готов, тикеты обслуживаются
+    с деградацией: без модели классификатора работают ключевые слова, без
+    индекса эмбеддингов - только триггеры базы знаний. В режиме lazy воркер
+    готов сразу, а компонент грузится при первом ensure().
+    """
+
+    def __init__(self, mode: str = STARTUP_MODE):
+        if mode not in STARTUP_MODES:
+            raise ValueError(f"Unknown STARTUP_MODE {mode!r}, expected one of {STARTUP_MODES}")
+        self.mode = mode
+        self.components: Dict[str, Component] = {}
+        self.started_at = time.monotonic()
+        self.ready_after: Optional[float] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def add(self, name: str, load: Callable[[], Awaitable[bool]], required: bool = True, enabled: bool = True):
+        """Регистрирует компонент; load возвращает False, если загружать было нечего."""
+        self.components[name] = Component(name, load, required, enabled)
+
+    async def _load(self, component: Component):
+        component.state = Component.LOADING
+        started = time.monotonic()
+        try:
+            loaded = await component.load()
+            component.state = Component.READY if loaded else Component.DISABLED
+        except Exception as e:
+            component.state = Component.FAILED
+            component.error = str(e)
+            logger.warning(f"Component {component.name} failed to load: {e}")
+        component.seconds = time.monotonic() - started
+        logger.info(f"Component {component.name}: {component.state} in {component.seconds:.2f}s")
+        if self.ready_after is None and self.ready:
+            self.ready_after = time.monotonic() - self.started_at
+
+    async def _load_all(self):
+        # По очереди: параллельная загрузка моделей делит CPU с уже идущими тикетами
+        for component in self.components.values():
+            if component.state == Component.PENDING:
+                await self._load(component)
+
+    async def start(self):
+        self.started_at = time.monotonic()
+        if self.mode == "eager":
+            await self._load_all()
+        elif self.mode == "background":
+            self._tasks.append(asyncio.create_task(self._load_all()))
+        if self.ready_after is None and self.ready:
+            self.ready_after = 0.0
+
+    def ensure(self, name: str):
+        """Запускает загрузку компонента в фоне, если она еще не начиналась; не ждет ее."""
+        component = self.components.get(name)
+        if component is None or component.state != Component.PENDING:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        component.state = Component.LOADING
+        self._tasks.append(loop.create_task(self._load(component)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    @property
+    def ready(self) -> bool:
+        if self.mode == "lazy":
+            return True
+        return all(c.settled for c in self.components.values() if c.required)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "ready": self.ready,
+            "ready_after": None if self.ready_after is None else round(self.ready_after, 3),
+            "components": {name: c.snapshot() for name, c in self.components.items()},
+        }
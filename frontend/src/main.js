@@ -11,6 +11,11 @@ const chatApp = {
   API_URL: "/api/tickets/",
   HEALTH_URL: "/api/health",
 
+  // Ключ localStorage с постоянным id пользователя: лимиты и сессии
+  // бэкенда считаются по user_id, поэтому он не должен меняться между сообщениями
+  USER_ID_KEY: "techsupport_user_id",
+  userId: null,
+
   // Инициализация приложения
   init() {
     this.elements.chatDiv = document.getElementById("chat");
@@ -32,6 +37,31 @@ const chatApp = {
     this.checkBackendStatus();
   },
 
+  // id пользователя: создается один раз и хранится в браузере
+  getUserId() {
+    if (this.userId) {
+      return this.userId;
+    }
+    try {
+      this.userId = localStorage.getItem(this.USER_ID_KEY);
+    } catch (error) {
+      // localStorage недоступен (приватный режим) - id живет до перезагрузки страницы
+    }
+    if (!this.userId) {
+      this.userId =
+        "user_" +
+        (window.crypto && crypto.randomUUID
+          ? crypto.randomUUID()
+          : Date.now().toString(36) + Math.random().toString(36).slice(2));
+      try {
+        localStorage.setItem(this.USER_ID_KEY, this.userId);
+      } catch (error) {
+        console.warn("⚠️ Не удалось сохранить user_id:", error);
+      }
+    }
+    return this.userId;
+  },
+
   // Проверка состояния бэкенда
   async checkBackendStatus() {
     try {
@@ -135,7 +165,7 @@ const chatApp = {
           "Content-Type": "application/json",
         },
         body: JSON.stringify({
-          user_id: "user_" + Date.now(),
+          user_id: this.getUserId(),
           message: text,
         }),
       });